@@ -0,0 +1,54 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+
+class ActivityMatchIndex:
+    """
+    An index over Strava activities for matching Garmin activities by their local start time.
+    Start times are parsed once and truncated to the minute, because Garmin only shows hours and minutes.
+    """
+    def __init__(self, activities, tolerance_minutes=1):
+        self.tolerance_minutes = tolerance_minutes
+        self._activities_by_minute = {}
+        for activity in activities:
+            minute = self._minute_key(datetime.strptime(activity['start_date_local'], "%Y-%m-%dT%H:%M:%SZ"))
+            self._activities_by_minute.setdefault(minute, []).append(activity)
+        # Sorted minute keys for the bisect lookup within the tolerance
+        self._sorted_minutes = sorted(self._activities_by_minute)
+
+    @staticmethod
+    def _minute_key(date):
+        # Number of whole minutes since the epoch of the naive local time
+        if not isinstance(date, datetime):
+            date = datetime(date.year, date.month, date.day)
+        return int((date - datetime(1970, 1, 1)).total_seconds() // 60)
+
+    def __len__(self):
+        return sum(len(activities) for activities in self._activities_by_minute.values())
+
+    def find(self, date, duration_seconds=None):
+        """
+        Find the Strava activity that started at the given local time.
+        An exact minute match wins; otherwise the closest start within the tolerance is used.
+        Several candidates are told apart by how close their elapsed time is to the given duration.
+        """
+        minute = self._minute_key(date)
+        candidates = self._activities_by_minute.get(minute)
+
+        if not candidates and self.tolerance_minutes:
+            low = bisect_left(self._sorted_minutes, minute - self.tolerance_minutes)
+            high = bisect_right(self._sorted_minutes, minute + self.tolerance_minutes)
+            nearby_minutes = self._sorted_minutes[low:high]
+            if nearby_minutes:
+                closest_distance = min(abs(nearby_minute - minute) for nearby_minute in nearby_minutes)
+                candidates = [
+                    activity
+                    for nearby_minute in nearby_minutes if abs(nearby_minute - minute) == closest_distance
+                    for activity in self._activities_by_minute[nearby_minute]
+                ]
+
+        if not candidates:
+            return None
+        if len(candidates) == 1 or duration_seconds is None:
+            return candidates[0]
+        return min(candidates, key=lambda activity: abs(activity.get('elapsed_time', 0) - duration_seconds))
@@ -0,0 +1,156 @@
+import json
+import sqlite3
+from datetime import datetime
+
+
+class ActivityStore:
+    """
+    A persistent local store for Strava activity summaries, backed by SQLite
+    """
+    def __init__(self, db_file="strava_activities.db"):
+        self.db_file = db_file
+        # The webhook server may handle events on another thread than the one that opened the store
+        self._connection = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS activities (
+                id INTEGER PRIMARY KEY,
+                start_timestamp INTEGER NOT NULL,
+                start_date_local TEXT,
+                sport_type TEXT,
+                name TEXT,
+                data TEXT NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_activities_start ON activities (start_timestamp)")
+        # Activity IDs pushed by the Strava webhook that a pipeline still has to process
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pending_activities (
+                activity_id INTEGER NOT NULL,
+                pipeline TEXT NOT NULL,
+                aspect_type TEXT NOT NULL,
+                event_time INTEGER NOT NULL,
+                PRIMARY KEY (activity_id, pipeline)
+            )
+            """
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def _start_timestamp(activity):
+        """
+        Convert the UTC start date of an activity to a Unix timestamp
+        """
+        return int(datetime.fromisoformat(activity['start_date'].replace('Z', '+00:00')).timestamp())
+
+    def _insert_activities(self, activities):
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO activities (id, start_timestamp, start_date_local, sport_type, name, data) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    activity['id'],
+                    self._start_timestamp(activity),
+                    activity.get('start_date_local'),
+                    activity.get('sport_type'),
+                    activity.get('name'),
+                    json.dumps(activity),
+                )
+                for activity in activities
+            ],
+        )
+
+    def upsert_activities(self, activities):
+        """
+        Insert new activities or replace the stored version of already known ones
+        """
+        with self._connection:
+            self._insert_activities(activities)
+        return len(activities)
+
+    def replace_window(self, after_timestamp, before_timestamp, activities):
+        """
+        Replace every stored activity in the given time window with the freshly fetched ones,
+        so activities deleted on Strava disappear from the store as well
+        """
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM activities WHERE start_timestamp > ? AND start_timestamp < ?",
+                (after_timestamp, before_timestamp),
+            )
+            self._insert_activities(activities)
+        return len(activities)
+
+    def get_high_water_mark(self):
+        """
+        Get the Unix timestamp of the most recent stored activity, or None if the store is empty
+        """
+        row = self._connection.execute("SELECT MAX(start_timestamp) FROM activities").fetchone()
+        return row[0]
+
+    def get_activities(self, after_timestamp, before_timestamp):
+        """
+        Get all stored activities that started strictly between the two Unix timestamps,
+        oldest first (the same filter semantics as Strava's after/before parameters)
+        """
+        rows = self._connection.execute(
+            "SELECT data FROM activities WHERE start_timestamp > ? AND start_timestamp < ? "
+            "ORDER BY start_timestamp, id",
+            (after_timestamp, before_timestamp),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_activity(self, activity_id):
+        row = self._connection.execute("SELECT data FROM activities WHERE id = ?", (activity_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update_activity_fields(self, activity_id, fields):
+        """
+        Apply changed fields to a stored activity, e.g. a new name pushed by the webhook
+        """
+        activity = self.get_activity(activity_id)
+        if activity is None:
+            return False
+        activity.update(fields)
+        self.upsert_activities([activity])
+        return True
+
+    def delete_activity(self, activity_id):
+        with self._connection:
+            self._connection.execute("DELETE FROM activities WHERE id = ?", (activity_id,))
+            self._connection.execute("DELETE FROM pending_activities WHERE activity_id = ?", (activity_id,))
+
+    def queue_activity(self, activity_id, pipelines, aspect_type, event_time):
+        """
+        Queue an activity for the given pipelines. An activity that is already queued for a
+        pipeline keeps its first aspect type, so a create followed by updates stays a create.
+        """
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO pending_activities (activity_id, pipeline, aspect_type, event_time) "
+                "VALUES (?, ?, ?, ?)",
+                [(activity_id, pipeline, aspect_type, event_time) for pipeline in pipelines],
+            )
+
+    def get_pending_activity_ids(self, pipeline):
+        rows = self._connection.execute(
+            "SELECT activity_id FROM pending_activities WHERE pipeline = ? ORDER BY event_time, activity_id",
+            (pipeline,),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def mark_processed(self, activity_ids, pipeline):
+        with self._connection:
+            self._connection.executemany(
+                "DELETE FROM pending_activities WHERE activity_id = ? AND pipeline = ?",
+                [(activity_id, pipeline) for activity_id in activity_ids],
+            )
+
+    def count(self):
+        return self._connection.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+# Summary fields that change when an activity is edited on Strava. The summaries of the activity list
+# carry no description, so a description edit can't be detected and is not part of the key.
+EDIT_RELEVANT_FIELDS = [
+    'name', 'sport_type', 'distance', 'moving_time', 'elapsed_time',
+    'start_date', 'total_elevation_gain', 'private', 'workout_type',
+]
+
+
+class ActivityDetailCache:
+    """
+    An on-disk cache of Strava activity details with LRU eviction, backed by SQLite.
+    StravaClient only uses it for lookups that come with an activity summary, i.e. the Garmin transfers,
+    and only for activities older than DETAIL_CACHE_MIN_AGE_DAYS. The sheets update passes bare IDs
+    and always fetches fresh details, since it needs the current description.
+    """
+    def __init__(self, db_file="strava_detail_cache.db", max_entries=5000, max_bytes=100 * 1024 * 1024):
+        self.db_file = db_file
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # The cache is shared by the detail-fetching worker threads
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS details (
+                cache_key TEXT PRIMARY KEY,
+                activity_id INTEGER NOT NULL,
+                include_efforts INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS idx_details_access ON details (last_access)")
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(activity_id, include_efforts, summary):
+        """
+        Build the cache key from the activity ID and the edit-relevant fields of its summary,
+        so e.g. a changed name, sport type or distance results in a different key
+        """
+        fields = {field: summary.get(field) for field in EDIT_RELEVANT_FIELDS}
+        digest = hashlib.sha1(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+        return f"{activity_id}:{int(bool(include_efforts))}:{digest}"
+
+    def get(self, cache_key):
+        """
+        Get the cached details for a key, or None on a miss
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM details WHERE cache_key = ?", (cache_key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._connection:
+                self._connection.execute(
+                    "UPDATE details SET last_access = ? WHERE cache_key = ?", (time.time(), cache_key))
+            return json.loads(row[0])
+
+    def put(self, cache_key, activity_id, include_efforts, details):
+        """
+        Store the details for a key, dropping outdated versions of the same activity
+        and evicting the least recently used entries once the cache is over its caps
+        """
+        data = json.dumps(details)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM details WHERE activity_id = ? AND include_efforts = ?",
+                (activity_id, int(bool(include_efforts))),
+            )
+            self._connection.execute(
+                "INSERT INTO details (cache_key, activity_id, include_efforts, data, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (cache_key, activity_id, int(bool(include_efforts)), data, len(data), time.time()),
+            )
+            self._evict()
+
+    def _evict(self):
+        entries, total_bytes = self._connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM details").fetchone()
+        if entries <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+
+        # Walk the entries from least to most recently used until both caps are met again
+        to_delete = []
+        for cache_key, size in self._connection.execute("SELECT cache_key, size FROM details ORDER BY last_access"):
+            if entries <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            to_delete.append((cache_key,))
+            entries -= 1
+            total_bytes -= size
+        self._connection.executemany("DELETE FROM details WHERE cache_key = ?", to_delete)
+        self.evictions += len(to_delete)
+
+    def stats(self):
+        with self._lock:
+            entries, total_bytes = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM details").fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': total_bytes,
+        }
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,272 @@
+import copy
+import json
+from collections import Counter, deque, namedtuple
+
+import gspread
+import requests
+from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+from gspread.utils import a1_range_to_grid_range
+
+# Simulated round-trip time in seconds per kind of API request
+LATENCY_CLASSES = {
+    'drive': 0.2,
+    'metadata': 0.35,
+    'read': 0.25,
+    'write': 0.45,
+    'structure': 0.9,
+}
+
+FakeApiCall = namedtuple('FakeApiCall', ['operation', 'latency_class', 'started_at'])
+
+
+class SimulatedClock:
+    """
+    A clock that only moves when simulated requests or sleeps advance it.
+    Pass sleep and monotonic to SheetsRequestScheduler so its waits cost no real time.
+    """
+    def __init__(self):
+        self.now = 0.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FakeSheet:
+    """
+    One worksheet of the in-memory spreadsheet, with cells keyed by zero-based (row, column)
+    """
+    def __init__(self, sheet_id, title, cells=None):
+        self.sheet_id = sheet_id
+        self.title = title
+        self.cells = dict(cells or {})
+
+    def get_properties(self, index):
+        return {
+            'sheetId': self.sheet_id,
+            'title': self.title,
+            'index': index,
+            'sheetType': 'GRID',
+            'gridProperties': {'rowCount': 1000, 'columnCount': 26},
+        }
+
+
+class FakeSheetsHTTPClient(HTTPClient):
+    """
+    An in-memory stand-in for gspread's HTTP client. The real gspread Spreadsheet and Worksheet
+    classes run on top of it, and every request is recorded with its latency class and
+    charged to the simulated clock. Like the real API, requests beyond the per-minute quota
+    are answered with 429.
+    """
+    def __init__(self, clock=None, requests_per_minute=60):
+        # The base class needs credentials, which the stand-in doesn't use
+        self.clock = clock or SimulatedClock()
+        self.requests_per_minute = requests_per_minute
+        self.calls = []
+        self.sheets = []
+        self.modified_time = 0
+        self._request_times = deque()
+
+    # Setup
+
+    def add_sheet(self, title, cells=None, index=None):
+        """
+        Add a worksheet, with cells given as {A1 cell: value}
+        """
+        sheet_id = max((sheet.sheet_id for sheet in self.sheets), default=-1) + 1
+        sheet = FakeSheet(sheet_id, title)
+        for cell, value in (cells or {}).items():
+            grid_range = a1_range_to_grid_range(cell)
+            sheet.cells[(grid_range['startRowIndex'], grid_range['startColumnIndex'])] = value
+        self.sheets.insert(len(self.sheets) if index is None else index, sheet)
+        return sheet
+
+    def get_sheet(self, title):
+        return next((sheet for sheet in self.sheets if sheet.title == title), None)
+
+    def get_value(self, title, cell):
+        grid_range = a1_range_to_grid_range(cell)
+        return self.get_sheet(title).cells.get((grid_range['startRowIndex'], grid_range['startColumnIndex']))
+
+    # Bookkeeping
+
+    def _record(self, operation, latency_class):
+        now = self.clock.monotonic()
+        while self._request_times and now - self._request_times[0] >= 60:
+            self._request_times.popleft()
+        if self.requests_per_minute and len(self._request_times) >= self.requests_per_minute:
+            self.calls.append(FakeApiCall(operation, 'throttled', now))
+            raise APIError(self._error_response(429, "Quota exceeded for quota metric 'Read requests'"))
+        self._request_times.append(now)
+        self.calls.append(FakeApiCall(operation, latency_class, now))
+        self.clock.advance(LATENCY_CLASSES[latency_class])
+
+    @staticmethod
+    def _error_response(status_code, message):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps({'error': {'code': status_code, 'message': message}}).encode('utf-8')
+        return response
+
+    def call_counts(self):
+        """
+        Count the recorded requests per latency class, including the throttled ones
+        """
+        return Counter(call.latency_class for call in self.calls)
+
+    def reset_calls(self):
+        self.calls = []
+
+    # Range handling
+
+    def _resolve_range(self, range_name):
+        if '!' in range_name:
+            title, cells = range_name.rsplit('!', 1)
+            title = title[1:-1].replace("''", "'") if title.startswith("'") else title
+        else:
+            title, cells = self.sheets[0].title, range_name
+        sheet = self.get_sheet(title)
+        if sheet is None:
+            raise APIError(self._error_response(400, f"Unable to parse range: {range_name}"))
+        grid_range = a1_range_to_grid_range(cells)
+        return sheet, grid_range
+
+    @staticmethod
+    def _render(value, value_render_option):
+        if isinstance(value, str) and value.startswith('=') and value_render_option != 'FORMULA':
+            # Show what the formula displays, e.g. the label of a HYPERLINK
+            if value.upper().startswith('=HYPERLINK('):
+                return value.rstrip(')').rsplit('"', 2)[-2]
+            return value
+        return value
+
+    def _read_range(self, range_name, params):
+        sheet, grid_range = self._resolve_range(range_name)
+        used_rows = max((row for row, _ in sheet.cells), default=-1) + 1
+        used_columns = max((column for _, column in sheet.cells), default=-1) + 1
+        first_row = grid_range.get('startRowIndex', 0)
+        last_row = min(grid_range.get('endRowIndex', used_rows), used_rows)
+        first_column = grid_range.get('startColumnIndex', 0)
+        last_column = min(grid_range.get('endColumnIndex', used_columns), used_columns)
+        value_render_option = (params or {}).get('valueRenderOption', 'FORMATTED_VALUE')
+
+        rows = [
+            [self._render(sheet.cells.get((row, column), ''), value_render_option)
+             for column in range(first_column, last_column)]
+            for row in range(first_row, last_row)
+        ]
+        if (params or {}).get('majorDimension') == 'COLUMNS':
+            rows = [list(column) for column in zip(*rows)]
+        # Like the API, leave out trailing empty cells and rows
+        for row in rows:
+            while row and row[-1] == '':
+                row.pop()
+        while rows and not rows[-1]:
+            rows.pop()
+
+        value_range = {'range': range_name, 'majorDimension': (params or {}).get('majorDimension', 'ROWS')}
+        if rows:
+            value_range['values'] = rows
+        return value_range
+
+    def _write_range(self, range_name, values, major_dimension='ROWS'):
+        sheet, grid_range = self._resolve_range(range_name)
+        if major_dimension == 'COLUMNS':
+            values = [list(row) for row in zip(*values)]
+        for i, row in enumerate(values):
+            for j, value in enumerate(row):
+                if value is None:
+                    continue
+                position = (grid_range.get('startRowIndex', 0) + i, grid_range.get('startColumnIndex', 0) + j)
+                if value == '':
+                    sheet.cells.pop(position, None)
+                else:
+                    sheet.cells[position] = value
+        self.modified_time += 1
+        return len(values) * max((len(row) for row in values), default=0)
+
+    # HTTPClient interface used by gspread
+
+    def request(self, method, endpoint, **kwargs):
+        raise NotImplementedError(f"FakeSheetsHTTPClient does not support {method.upper()} {endpoint}")
+
+    def get_file_drive_metadata(self, id):
+        self._record('drive.files.get', 'drive')
+        return {'id': id, 'name': 'Trainingstagebuch', 'modifiedTime': f"2024-01-01T00:00:{self.modified_time:09d}Z"}
+
+    def fetch_sheet_metadata(self, id, params=None):
+        self._record('spreadsheets.get', 'metadata')
+        return {
+            'spreadsheetId': id,
+            'properties': {'title': 'Trainingstagebuch', 'locale': 'de_DE', 'timeZone': 'Europe/Berlin'},
+            'sheets': [{'properties': sheet.get_properties(index)} for index, sheet in enumerate(self.sheets)],
+        }
+
+    def values_get(self, id, range, params=None):
+        self._record('values.get', 'read')
+        return self._read_range(range, params)
+
+    def values_batch_get(self, id, ranges, params=None):
+        self._record('values.batchGet', 'read')
+        return {'spreadsheetId': id, 'valueRanges': [self._read_range(range_name, params) for range_name in ranges]}
+
+    def values_update(self, id, range, params=None, body=None):
+        self._record('values.update', 'write')
+        updated_cells = self._write_range(range, body['values'], body.get('majorDimension', 'ROWS'))
+        return {'spreadsheetId': id, 'updatedRange': range, 'updatedCells': updated_cells}
+
+    def values_batch_update(self, id, body=None):
+        self._record('values.batchUpdate', 'write')
+        updated_cells = sum(self._write_range(data['range'], data['values'], data.get('majorDimension', 'ROWS'))
+                            for data in body['data'])
+        return {'spreadsheetId': id, 'totalUpdatedCells': updated_cells}
+
+    def batch_update(self, id, body):
+        self._record('spreadsheets.batchUpdate', 'structure')
+        # The real API applies all requests or none of them
+        sheets_before = [copy.deepcopy(sheet) for sheet in self.sheets]
+        try:
+            replies = [self._apply_request(request) for request in body['requests']]
+        except APIError:
+            self.sheets = sheets_before
+            raise
+        self.modified_time += 1
+        return {'spreadsheetId': id, 'replies': replies}
+
+    def _apply_request(self, request):
+        if 'duplicateSheet' in request:
+            options = request['duplicateSheet']
+            if self.get_sheet(options['newSheetName']) is not None:
+                raise APIError(self._error_response(
+                    400, f"A sheet with the name \"{options['newSheetName']}\" already exists."))
+            source = next(sheet for sheet in self.sheets if sheet.sheet_id == options['sourceSheetId'])
+            sheet_id = options.get('newSheetId', max(sheet.sheet_id for sheet in self.sheets) + 1)
+            index = options.get('insertSheetIndex', len(self.sheets))
+            self.sheets.insert(index, FakeSheet(sheet_id, options['newSheetName'], source.cells))
+            return {'duplicateSheet': {'properties': self.sheets[index].get_properties(index)}}
+
+        if 'updateCells' in request:
+            options = request['updateCells']
+            sheet = next(sheet for sheet in self.sheets if sheet.sheet_id == options['start']['sheetId'])
+            for i, row in enumerate(options['rows']):
+                for j, cell in enumerate(row.get('values', [])):
+                    value = next(iter(cell.get('userEnteredValue', {'stringValue': ''}).values()))
+                    sheet.cells[(options['start']['rowIndex'] + i, options['start']['columnIndex'] + j)] = value
+            return {}
+
+        raise NotImplementedError(f"FakeSheetsHTTPClient does not support the request {list(request)}")
+
+
+def create_fake_spreadsheet(client):
+    """
+    Open the in-memory spreadsheet of a FakeSheetsHTTPClient through gspread's own Spreadsheet class
+    """
+    return gspread.Spreadsheet(client, {'id': 'fake-spreadsheet', 'name': 'Trainingstagebuch'})
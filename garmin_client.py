@@ -1,13 +1,15 @@
+import argparse
 import datetime
 import re
 
 import os
 import time
+from contextlib import contextmanager
 
 import unicodedata
 from dateutil import parser
 from dotenv import load_dotenv
-from selenium.common import StaleElementReferenceException
+from selenium.common import StaleElementReferenceException, TimeoutException
 from selenium.webdriver import ActionChains
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
@@ -15,11 +17,154 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 import undetected_chromedriver as uc
 
+from garmin_session import GarminSessionStore
+
 # Load environment variables from .env file
 load_dotenv()
 
+# How often the condition-based waits check the page
+POLL_INTERVAL_SECONDS = 0.1
+
+# The sidebar button that opens the activities menu, only rendered for a signed-in user
+SIDEBAR_ACTIVITIES_BUTTON_XPATH = "//button[@class='MainSidebar_menuItemLink__ec-sE' and @aria-label='Activities']"
+
+# Resources the automation never looks at: images, fonts, video, analytics and map tiles.
+# Matched by Chrome against every request URL, "*" is a wildcard.
+BLOCKED_URL_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.m3u8",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*facebook.net*",
+    "*hotjar.com*", "*nr-data.net*", "*newrelic.com*", "*optimizely.com*", "*cookielaw.org*", "*onetrust.com*",
+    "*api.mapbox.com*", "*tiles.mapbox.com*", "*maps.googleapis.com*", "*maps.gstatic.com*", "*tile.openstreetmap.org*",
+]
+
+# Pages loaded by compare_browser_profiles
+PROFILE_COMPARISON_URLS = [
+    "https://connect.garmin.com/modern/",
+    "https://connect.garmin.com/modern/activities",
+]
+
+class StepTimer:
+    """
+    Collects how long each waiting step of the Garmin automation took, next to the fixed sleep it replaced
+    """
+    def __init__(self):
+        self._durations = {}
+        self._replaced_sleeps = {}
+
+    @contextmanager
+    def measure(self, step, replaced_sleep_seconds=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._durations.setdefault(step, []).append(time.perf_counter() - start)
+            self._replaced_sleeps[step] = self._replaced_sleeps.get(step, 0) + replaced_sleep_seconds
+
+    def report(self):
+        """
+        Print count, total and average time per step and the time saved against the old fixed sleeps
+        """
+        if not self._durations:
+            return
+        print("Garmin step timings:")
+        total_saved = 0
+        for step, durations in self._durations.items():
+            total = sum(durations)
+            saved = self._replaced_sleeps[step] - total
+            total_saved += saved
+            print(f"  {step}: {len(durations)}x, {total:.1f} s total, {total / len(durations):.2f} s average, "
+                  f"{saved:.1f} s saved against fixed sleeps")
+        print(f"  Total time saved: {total_saved:.1f} s")
+
 class GarminClient:
+    def __init__(self, session_store=None):
+        self.step_timer = StepTimer()
+        self.session_store = session_store or GarminSessionStore()
+        # The driver this client already logged in, so several transfers in one run log in only once
+        self._signed_in_driver = None
+
+    def wait_for_page_ready(self, driver, timeout=20):
+        """
+        Wait until the browser reports the current document as completely loaded
+        """
+        WebDriverWait(driver, timeout, poll_frequency=POLL_INTERVAL_SECONDS).until(
+            lambda driver: driver.execute_script("return document.readyState") == "complete")
+
+    def get_current_activity_id(self, driver):
+        match = re.search(r"/activity/(\d+)", driver.current_url)
+        return match.group(1) if match else None
+
+    def get_activity_time_text(self, driver):
+        # The start time of the activity that is currently shown, or None while the page is changing
+        try:
+            elements = driver.find_elements(By.CSS_SELECTOR, "span.ActivityMetaInfo_time__HcDIK")
+            return elements[0].text.strip() if elements else None
+        except StaleElementReferenceException:
+            return None
+
+    def wait_for_activity_change(self, driver, previous_activity_id, previous_time_text, timeout=20):
+        """
+        Wait until another activity is shown: the activity ID in the URL and the displayed start time
+        both differ from the previous ones, and the page has finished loading.
+        The start time is shown relative ("Today @ 7:02 AM"), so two activities started in the same minute
+        look alike; if only the ID changed when the wait times out, the loaded page is taken as the new activity.
+        """
+        def activity_changed(driver):
+            # The app changes the URL before it renders the new activity, so the ID alone is not enough
+            activity_id = self.get_current_activity_id(driver)
+            if previous_activity_id is not None and activity_id == previous_activity_id:
+                return False
+            time_text = self.get_activity_time_text(driver)
+            return time_text is not None and time_text != previous_time_text
+
+        try:
+            WebDriverWait(driver, timeout, poll_frequency=POLL_INTERVAL_SECONDS).until(activity_changed)
+        except TimeoutException:
+            activity_id = self.get_current_activity_id(driver)
+            if previous_activity_id is None or activity_id is None or activity_id == previous_activity_id \
+                    or driver.execute_script("return document.readyState") != "complete":
+                raise
+            print(f"Start time of activity {activity_id} looks like the previous one, continuing with it")
+        self.wait_for_page_ready(driver, timeout)
+
+    @staticmethod
+    def is_sign_in_url(url):
+        url = url.lower()
+        return 'signin' in url or 'login' in url or 'sso.garmin.com' in url
+
+    def is_signed_in(self, driver, timeout=15):
+        """
+        Open Garmin Connect and check whether it shows the app or redirects to the sign-in page.
+        The /modern URL and a loaded document are not enough, the app shell renders there before it
+        finds out the session is gone; only the signed-in app shows the sidebar.
+        """
+        driver.get("https://connect.garmin.com/modern/")
+        try:
+            WebDriverWait(driver, timeout, poll_frequency=POLL_INTERVAL_SECONDS).until(
+                lambda driver: self.is_sign_in_url(driver.current_url)
+                or driver.find_elements(By.XPATH, SIDEBAR_ACTIVITIES_BUTTON_XPATH))
+        except TimeoutException:
+            return False
+        return not self.is_sign_in_url(driver.current_url)
+
     def login(self, driver, wait):
+        if driver is self._signed_in_driver:
+            return
+        # A session stored by an earlier run spares the whole login form
+        if self.session_store.restore(driver):
+            if self.is_signed_in(driver):
+                print("✅ Signed in with the stored Garmin session")
+                self.session_store.save(driver)
+                self._signed_in_driver = driver
+                return
+            print("Stored Garmin session is no longer valid, logging in again...")
+        self.login_with_credentials(driver, wait)
+        self.session_store.save(driver)
+        self._signed_in_driver = driver
+
+    def login_with_credentials(self, driver, wait):
         try:
             print("Navigating to Garmin login page...")
             # Try multiple possible login URLs
@@ -34,7 +179,8 @@ class GarminClient:
                 try:
                     print(f"Trying URL: {url}")
                     driver.get(url)
-                    time.sleep(2)
+                    with self.step_timer.measure("login page load", replaced_sleep_seconds=2):
+                        self.wait_for_page_ready(driver)
                     
                     # Check if we got a valid login page
                     current_url = driver.current_url
@@ -53,12 +199,15 @@ class GarminClient:
                 # If we get here, none of the URLs worked
                 raise Exception("Could not access any valid Garmin login page")
             
-            # Wait for page to load completely
+            # Wait for page to load completely, including the dynamically rendered login form
             print("Waiting for page to load...")
-            wait.until(lambda driver: driver.execute_script("return document.readyState") == "complete")
-            
-            # Wait a bit more for dynamic content to load
-            time.sleep(3)
+            with self.step_timer.measure("login form", replaced_sleep_seconds=3):
+                self.wait_for_page_ready(driver)
+                try:
+                    WebDriverWait(driver, 10, poll_frequency=POLL_INTERVAL_SECONDS).until(
+                        EC.presence_of_element_located((By.ID, 'email')))
+                except TimeoutException:
+                    pass
             
             # Check if we're on the right page
             current_url = driver.current_url
@@ -122,9 +271,16 @@ class GarminClient:
             print("Clicking login button...")
             login_button.click()
             
-            # Wait for login to complete (look for redirect or success indicators)
+            # Wait for login to complete: the browser leaves the sign-in page once the credentials are accepted
             print("Waiting for login to complete...")
-            time.sleep(5)
+            with self.step_timer.measure("login redirect", replaced_sleep_seconds=5):
+                try:
+                    WebDriverWait(driver, 20, poll_frequency=POLL_INTERVAL_SECONDS).until(
+                        lambda driver: 'signin' not in driver.current_url.lower()
+                        and 'login' not in driver.current_url.lower()
+                        and driver.execute_script("return document.readyState") == "complete")
+                except TimeoutException:
+                    print("No redirect after the login attempt")
             
             # Check for potential CAPTCHA or security challenges
             try:
@@ -220,8 +376,7 @@ class GarminClient:
         return date_obj
 
     def open_activity_overview(self, driver, wait):
-        wait.until(EC.element_to_be_clickable((By.XPATH,
-                                               "//button[@class='MainSidebar_menuItemLink__ec-sE' and @aria-label='Activities']"))).click()
+        wait.until(EC.element_to_be_clickable((By.XPATH, SIDEBAR_ACTIVITIES_BUTTON_XPATH))).click()
         wait.until(EC.element_to_be_clickable((By.XPATH, "//a[@class='MainSidebar_menuItemLink__ec-sE MainSidebar_menuItemLinkChild__AsXDn' and @aria-label='All Activities']"))).click()
 
     def open_calendar_view(self, driver, wait):
@@ -233,8 +388,23 @@ class GarminClient:
         link = element.find_element(By.CSS_SELECTOR, "a[href*='/modern/activity/']")
         link.click()
 
+    def open_activity(self, driver, wait, activity_id):
+        """
+        Open an activity directly by its Garmin activity ID and wait until it can be edited
+        """
+        driver.get(f"https://connect.garmin.com/modern/activity/{activity_id}")
+        with self.step_timer.measure("activity page load"):
+            self.wait_for_page_ready(driver)
+            wait.until(EC.element_to_be_clickable(
+                (By.XPATH, "//button[@class='InlineEdit_editIcon__7vqhd' and @aria-label='Edit']")))
+
     def click_previous_button(self, driver, wait):
+        # Remember what is shown now, so the wait can tell when the previous activity has replaced it
+        previous_activity_id = self.get_current_activity_id(driver)
+        previous_time_text = self.get_activity_time_text(driver)
         self.click_element(driver, wait, (By.XPATH, "//button[@aria-label='View Previous']"))
+        with self.step_timer.measure("activity transition", replaced_sleep_seconds=5):
+            self.wait_for_activity_change(driver, previous_activity_id, previous_time_text)
 
     def get_all_activities_after_date(self, driver, wait, date):
         comparisonDate = datetime.datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
@@ -311,6 +481,30 @@ class GarminClient:
         name = nameElement.text
         return name
 
+    def get_elapsed_duration_from_activity(self, driver):
+        """
+        Get the elapsed time in seconds of the activity that is currently shown, or None if it can't be read.
+        The page shows the duration only rounded, so it is requested from the endpoint the page itself uses.
+        """
+        try:
+            return driver.execute_async_script("""
+                var callback = arguments[arguments.length - 1];
+                var match = window.location.pathname.match(/\\/activity\\/(\\d+)/);
+                if (!match) { callback(null); return; }
+                var headers = {'Accept': 'application/json', 'NK': 'NT'};
+                var meta = document.querySelector('meta[name="csrf-token"]');
+                if (meta) { headers['connect-csrf-token'] = meta.content; }
+                fetch('/gc-api/activity-service/activity/' + match[1], {credentials: 'include', headers: headers})
+                    .then(function (response) { return response.ok ? response.json() : null; })
+                    .then(function (activity) {
+                        callback(activity && activity.summaryDTO ? activity.summaryDTO.elapsedDuration : null);
+                    })
+                    .catch(function () { callback(null); });
+            """)
+        except Exception as e:
+            print(f"Could not read the activity duration: {e}")
+            return None
+
     def open_activity_in_new_tab_and_get_date(self, driver, wait, element):
         driver.execute_script("arguments[0].scrollIntoView(true);", element)
 
@@ -355,8 +549,93 @@ class GarminClient:
         self.click_element(driver, wait,
                            (By.XPATH, "//button[@class='Button_btn__g8LLk Button_primary__7zt4j Button_small__waifo' and text()='Save']"))
 
+def create_driver(lean=True, headless=None, version_main=None):
+    """
+    Start Chrome for the Garmin automation.
+
+    Args:
+        lean (bool): Skip images, fonts, video, analytics and map tiles, which the automation never looks at.
+        headless (bool): Run without a window. Garmin's sign-in is known to block headless Chrome, so this
+            is off unless GARMIN_HEADLESS=1 is set or True is passed.
+        version_main (int): Major Chrome version for the driver, detected if None.
+
+    Returns:
+        uc.Chrome: The started driver.
+    """
+    if headless is None:
+        headless = os.getenv('GARMIN_HEADLESS') == '1'
+    options = uc.ChromeOptions()
+    options.add_argument('--window-size=1920,1080')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    if lean:
+        options.add_argument('--blink-settings=imagesEnabled=false')
+        options.add_argument('--disable-extensions')
+        options.add_argument('--mute-audio')
+        options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+
+    driver = uc.Chrome(options=options, headless=headless, use_subprocess=False, version_main=version_main)
+    if lean:
+        # Requests for blocked URLs fail right away, so the map and chart widgets render without their tiles
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+    return driver
+
+def get_page_load_metrics(driver):
+    """
+    Read the load time, number of requests and transferred bytes of the current page from the performance API
+    """
+    return driver.execute_script("""
+        var navigation = performance.getEntriesByType('navigation')[0];
+        var resources = performance.getEntriesByType('resource');
+        var transferredBytes = navigation ? navigation.transferSize : 0;
+        resources.forEach(function (resource) { transferredBytes += resource.transferSize || 0; });
+        return {
+            load_seconds: navigation ? (navigation.loadEventEnd - navigation.startTime) / 1000 : null,
+            requests: resources.length + (navigation ? 1 : 0),
+            transferred_bytes: transferredBytes
+        };
+    """)
+
+def compare_browser_profiles(urls=None, headless=None):
+    """
+    Load the same Garmin Connect pages with the standard and the lean browser profile and print
+    load time, requests and transferred bytes of each
+    """
+    urls = urls or PROFILE_COMPARISON_URLS
+    results = {}
+    for profile, lean in (("standard", False), ("lean", True)):
+        driver = create_driver(lean=lean, headless=headless)
+        try:
+            client = GarminClient()
+            client.login(driver, WebDriverWait(driver, 20))
+            for url in urls:
+                driver.get(url)
+                client.wait_for_page_ready(driver)
+                results[(profile, url)] = get_page_load_metrics(driver)
+        finally:
+            driver.quit()
+
+    print(f"{'page':<50}{'profile':>10}{'load s':>9}{'requests':>10}{'KB':>10}")
+    for (profile, url), metrics in results.items():
+        load_seconds = f"{metrics['load_seconds']:.2f}" if metrics['load_seconds'] is not None else "-"
+        print(f"{url:<50}{profile:>10}{load_seconds:>9}{metrics['requests']:>10}"
+              f"{metrics['transferred_bytes'] / 1024:>10.0f}")
+    return results
+
 def main():
-    driver = uc.Chrome(headless=False, use_subprocess=False)
+    parser = argparse.ArgumentParser(description="Try the Garmin Connect automation")
+    parser.add_argument("--compare-profiles", action="store_true",
+                        help="Compare page loads of the standard and the lean browser profile")
+    parser.add_argument("--headless", action="store_true",
+                        help="Run Chrome without a window (Garmin's sign-in may block it)")
+    args = parser.parse_args()
+
+    if args.compare_profiles:
+        compare_browser_profiles(headless=args.headless or None)
+        return
+
+    driver = create_driver(headless=args.headless or None)
     wait = WebDriverWait(driver, 20)
 
     client = GarminClient()
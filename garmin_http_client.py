@@ -0,0 +1,93 @@
+import os
+from datetime import datetime
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+class GarminHttpClient:
+    """
+    Reads and edits Garmin Connect activities through the JSON endpoints the Connect web app uses,
+    authenticated with the cookies of a browser session that is already signed in.
+    """
+    def __init__(self, base_url=None, page_size=100, request_timeout_seconds=30):
+        # The endpoints live below the web app's API prefix; point this at a stub server for testing
+        self.base_url = (base_url or os.getenv('GARMIN_API_BASE_URL', "https://connect.garmin.com/gc-api")).rstrip('/')
+        self.page_size = page_size
+        self.request_timeout_seconds = request_timeout_seconds
+        self._session = requests.Session()
+        # One pooled connection is reused for all requests of a transfer
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._session.headers.update({
+            'Accept': 'application/json',
+            'NK': 'NT',
+            'X-Requested-With': 'XMLHttpRequest',
+        })
+
+    def load_session_from_driver(self, driver):
+        """
+        Copy the cookies, user agent and CSRF token of a signed-in Selenium session
+        """
+        for cookie in driver.get_cookies():
+            self._session.cookies.set(cookie['name'], cookie['value'],
+                                      domain=cookie.get('domain'), path=cookie.get('path', '/'))
+        self._session.headers['User-Agent'] = driver.execute_script("return navigator.userAgent")
+        # The Connect web app sends the token from its page meta tag with every API request
+        csrf_token = driver.execute_script(
+            "var meta = document.querySelector('meta[name=\"csrf-token\"]'); return meta ? meta.content : null;")
+        if csrf_token:
+            self._session.headers['connect-csrf-token'] = csrf_token
+
+    def _request(self, method, path, **kwargs):
+        response = self._session.request(method, f"{self.base_url}{path}",
+                                         timeout=self.request_timeout_seconds, **kwargs)
+        if response.status_code in (401, 403):
+            raise Exception(f"Garmin Connect rejected the session ({response.status_code}), log in again")
+        response.raise_for_status()
+        return response
+
+    def list_activities(self, start=0, limit=None):
+        """
+        Get one page of activities, newest first
+        """
+        response = self._request("GET", "/activitylist-service/activities/search/activities",
+                                 params={'start': start, 'limit': limit or self.page_size})
+        return response.json()
+
+    def iter_activities(self):
+        """
+        Yield all activities newest first, fetching the list page by page
+        """
+        start = 0
+        while True:
+            activities = self.list_activities(start)
+            if not activities:
+                return
+            yield from activities
+            if len(activities) < self.page_size:
+                return
+            start += len(activities)
+
+    @staticmethod
+    def get_start_time_local(activity):
+        return datetime.strptime(activity['startTimeLocal'], "%Y-%m-%d %H:%M:%S")
+
+    def update_activity(self, activity_id, name=None, description=None):
+        """
+        Set the name and/or description of an activity with a single request
+        """
+        body = {'activityId': activity_id}
+        if name is not None:
+            body['activityName'] = name
+        if description is not None:
+            body['description'] = description
+        self._request("PUT", f"/activity-service/activity/{activity_id}", json=body)
+
+    def close(self):
+        self._session.close()
@@ -0,0 +1,113 @@
+import json
+import os
+import time
+
+from cryptography.fernet import Fernet, InvalidToken
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+class GarminSessionStore:
+    """
+    The cookie jar of a signed-in Garmin Connect browser session, persisted between runs and
+    encrypted at rest with a Fernet key from the GARMIN_SESSION_KEY environment variable.
+    Without a key nothing is stored and every run logs in from scratch.
+    Create a key with: python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"
+    """
+    def __init__(self, session_file="garmin_session.bin", key=None):
+        self.session_file = session_file
+        key = key or os.getenv('GARMIN_SESSION_KEY')
+        self._fernet = Fernet(key) if key else None
+
+    @property
+    def enabled(self):
+        return self._fernet is not None
+
+    def load(self):
+        """
+        Get the stored cookies, or None if there are none or they can't be decrypted
+        """
+        if not self.enabled or not os.path.exists(self.session_file):
+            return None
+        try:
+            with open(self.session_file, "rb") as f:
+                data = json.loads(self._fernet.decrypt(f.read()))
+        except (InvalidToken, ValueError):
+            print(f"Ignoring unreadable Garmin session {self.session_file}")
+            return None
+        # Cookies that expired since the last run would only be rejected by Garmin
+        now = time.time()
+        return [cookie for cookie in data['cookies'] if cookie.get('expiry', now + 1) > now]
+
+    def save(self, driver):
+        """
+        Store all cookies of the browser, including those of the sign-in domain
+        """
+        if not self.enabled:
+            return
+        cookies = get_browser_cookies(driver)
+        token = self._fernet.encrypt(json.dumps({'cookies': cookies}).encode('utf-8'))
+        tmp_file = f"{self.session_file}.tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(token)
+        os.replace(tmp_file, self.session_file)
+        print(f"✅ Saved Garmin session with {len(cookies)} cookies")
+
+    def restore(self, driver):
+        """
+        Put the stored cookies into the browser. Returns False if there was no session to restore.
+        """
+        cookies = self.load()
+        if not cookies:
+            return False
+        set_browser_cookies(driver, cookies)
+        return True
+
+    def clear(self):
+        if os.path.exists(self.session_file):
+            os.remove(self.session_file)
+
+
+def get_browser_cookies(driver):
+    """
+    Get the cookies of all domains from a browser, in Selenium's cookie format
+    """
+    try:
+        # The DevTools call returns the cookies of every domain, not only of the current page
+        return [_from_devtools_cookie(cookie) for cookie in driver.execute_cdp_cmd('Network.getAllCookies', {})['cookies']]
+    except Exception:
+        return driver.get_cookies()
+
+def set_browser_cookies(driver, cookies):
+    """
+    Put cookies from get_browser_cookies into a browser, e.g. to share one signed-in session between drivers
+    """
+    try:
+        driver.execute_cdp_cmd('Network.setCookies', {'cookies': [_to_devtools_cookie(cookie) for cookie in cookies]})
+    except Exception:
+        # Without DevTools, cookies can only be set for the domain that is currently open
+        driver.get("https://connect.garmin.com/")
+        for cookie in cookies:
+            try:
+                driver.add_cookie(cookie)
+            except Exception:
+                continue
+
+def _from_devtools_cookie(cookie):
+    selenium_cookie = {key: cookie[key] for key in ('name', 'value', 'domain', 'path', 'secure', 'httpOnly')
+                       if key in cookie}
+    # Session cookies have no expiry, DevTools marks them with -1
+    if cookie.get('expires', -1) > 0:
+        selenium_cookie['expiry'] = int(cookie['expires'])
+    if cookie.get('sameSite'):
+        selenium_cookie['sameSite'] = cookie['sameSite']
+    return selenium_cookie
+
+def _to_devtools_cookie(cookie):
+    devtools_cookie = {key: cookie[key] for key in ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite')
+                       if key in cookie}
+    if 'expiry' in cookie:
+        devtools_cookie['expires'] = cookie['expiry']
+    return devtools_cookie
@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Cookie the stub expects, standing in for the Garmin Connect session cookie
+SESSION_COOKIE = "SESSIONID"
+
+
+class GarminStubHandler(BaseHTTPRequestHandler):
+    """
+    Imitates the Garmin Connect activity list and activity update endpoints
+    """
+    def _is_signed_in(self):
+        return f"{SESSION_COOKIE}=" in self.headers.get('Cookie', '')
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if not self._is_signed_in():
+            self._send_json(401, {'error': 'not signed in'})
+            return
+        if url.path.endswith("/activitylist-service/activities/search/activities"):
+            query = parse_qs(url.query)
+            start = int(query.get('start', [0])[0])
+            limit = int(query.get('limit', [20])[0])
+            with self.server.lock:
+                activities = sorted(self.server.activities.values(),
+                                    key=lambda activity: activity['startTimeLocal'], reverse=True)
+                self._send_json(200, activities[start:start + limit])
+        else:
+            self._send_json(404, {'error': 'unknown endpoint'})
+
+    def do_PUT(self):
+        url = urlparse(self.path)
+        if not self._is_signed_in():
+            self._send_json(401, {'error': 'not signed in'})
+            return
+        if "/activity-service/activity/" not in url.path:
+            self._send_json(404, {'error': 'unknown endpoint'})
+            return
+
+        activity_id = int(url.path.rsplit('/', 1)[-1])
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        with self.server.lock:
+            activity = self.server.activities.get(activity_id)
+            if activity is None or body.get('activityId') != activity_id:
+                self._send_json(404, {'error': 'unknown activity'})
+                return
+            for field in ('activityName', 'description'):
+                if field in body:
+                    activity[field] = body[field]
+            self.server.updates.append(body)
+        # The real endpoint answers with an empty body
+        self.send_response(204)
+        self.end_headers()
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GarminStubServer(ThreadingHTTPServer):
+    """
+    A local stand-in for Garmin Connect's JSON endpoints, holding activities in memory
+    """
+    def __init__(self, activities=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), GarminStubHandler)
+        self.lock = threading.Lock()
+        self.activities = {activity['activityId']: dict(activity) for activity in activities or []}
+        self.updates = []
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Serve in a background thread, e.g. while a GarminHttpClient talks to the stub
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def make_stub_activities(count, newest_start=None):
+    """
+    Build Garmin-style activity summaries, one per day going back from the newest start time
+    """
+    newest_start = newest_start or datetime.now().replace(hour=7, minute=30, second=0, microsecond=0)
+    activities = []
+    for i in range(count):
+        start = newest_start - timedelta(days=i)
+        activities.append({
+            'activityId': 10000 + i,
+            'activityName': "Running",
+            'description': None,
+            'startTimeLocal': start.strftime("%Y-%m-%d %H:%M:%S"),
+            'duration': 1800.0,
+            'elapsedDuration': 1850.0,
+        })
+    return activities
+
+
+def main():
+    port = int(os.getenv('GARMIN_STUB_PORT', 8001))
+    server = GarminStubServer(make_stub_activities(30), port=port)
+    print(f"Serving a Garmin Connect stub at {server.base_url} (send the {SESSION_COOKIE} cookie)...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
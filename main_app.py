@@ -1,11 +1,18 @@
+import queue
+import threading
 import time
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
-from garmin_client import GarminClient
+from requests import HTTPError
+
+from activity_index import ActivityMatchIndex
 from strava_client import StravaClient
-from sheets_client import SheetsClient
-from selenium.webdriver.support.ui import WebDriverWait
-import undetected_chromedriver as uc
+from strava_webhook import GARMIN_PIPELINE, SHEETS_PIPELINE
+
+# Default Strava titles of workouts, which are not transferred to Garmin
+DEFAULT_WORKOUT_NAMES = ['Afternoon Workout', 'Morning Workout', 'Evening Workout', 'Lunch Workout', 'Night Workout']
 
 def get_first_not_completed_day(sheets_client):
     """
@@ -22,7 +29,7 @@ def get_first_not_completed_day(sheets_client):
 
 def get_activities_in_timeframe(strava_client, start_date, end_date):
     """
-    Retrieves all activities in a given timeframe from the Strava client.
+    Retrieves all activities in a given timeframe from the Strava client's local activity store.
 
     Args:
         strava_client (StravaClient): An instance of the StravaClient class.
@@ -36,8 +43,8 @@ def get_activities_in_timeframe(strava_client, start_date, end_date):
     start_date_str = start_date.strftime('%Y-%m-%d %H:%M:%S')
     end_date_str = end_date.strftime('%Y-%m-%d %H:%M:%S')
 
-    # Get all activities in the given timeframe from the Strava client
-    return strava_client.get_all_activities_in_timeframe(start_date_str, end_date_str)
+    # Get all activities in the given timeframe from the local store, which is synced once per run
+    return strava_client.get_stored_activities_in_timeframe(start_date_str, end_date_str)
 
 def filter_out_yoga_activities(activities):
     """
@@ -61,16 +68,25 @@ def update_sheets_with_activity_details(sheets_client, strava_client, activities
         strava_client (StravaClient): An instance of the StravaClient class.
         activities (list): A list of activities.
     """
-    # Iterate over the activities in reverse order
-    for i, activity in enumerate(reversed(activities)):
-        # Get the Strava data for the activity
-        activity_details = strava_client.get_strava_data_for_activity_with_specific_ID(
-            activity_id=activity['id'],
-            include_efforts=False
-        )
+    # Activities the ledger already records as written are skipped before any Strava or Sheets request
+    activities = sheets_client.filter_unsynced_activities(activities)
+    if not activities:
+        print("No new activities for the sheets.")
+        return
+
+    # Get the Strava data for all activities concurrently, in reverse order. The IDs bypass the detail cache,
+    # so descriptions edited on Strava reach the diary.
+    activities_details = strava_client.get_activities_details(
+        [activity['id'] for activity in reversed(activities)],
+        include_efforts=False
+    )
 
-        # Update the sheets with the activity details
-        sheets_client.set_new_entry_from_json(activity_details)
+    # Read every affected week worksheet and create the missing ones up front, then collect the entries
+    # in the same order and write them all in one batch at the end
+    sheets_client.prepare_week_worksheets_for_activities(activities_details)
+    with sheets_client.buffered_writes():
+        for activity_details in activities_details:
+            sheets_client.set_new_entry_from_json(activity_details)
 
 def update_p4_p7_worksheets(sheets_client, strava_client):
     """
@@ -87,14 +103,15 @@ def update_p4_p7_worksheets(sheets_client, strava_client):
         print("No worksheets to update.")
         return
 
-    # Collect all updates to do them in batches
-    all_updates = []
-    
-    # Iterate over the worksheets
+    # Read the headers of all worksheets in one request
+    sheets_client.load_week_grids([ws.title for ws in empty_p4_p7_worksheets])
+
+    # Parse the week ranges of all finished weeks from their headers
+    weeks = []
     for ws in empty_p4_p7_worksheets:
         try:
             # Get the cell value of the worksheet
-            cell_value = ws.acell('B1').value
+            cell_value = sheets_client.get_week_header(ws.title)
 
             # Split the cell value into separate values
             split_values = cell_value.split()
@@ -108,65 +125,81 @@ def update_p4_p7_worksheets(sheets_client, strava_client):
             start_date = start_date.replace(hour=0, minute=0, second=0)
             end_date = end_date.replace(hour=23, minute=59, second=59)
 
-            # Check if the end date is less than or equal to the current date
+            # Only weeks that are over get their counts
             if end_date <= datetime.now():
-                # Get all activities in the given timeframe
-                all_activities = get_activities_in_timeframe(strava_client, start_date, end_date)
-
-                # Filter out yoga activities
-                yoga_activities = [activity for activity in all_activities if activity['sport_type'] == "Yoga"]
-                yoga_count = len(yoga_activities)
-
-                # Filter out workout activities
-                workout_activities = [activity for activity in all_activities if activity['sport_type'] == "Workout"]
-                workout_count = len(workout_activities)
-
-                # Debug information
-                print(f"Worksheet {ws.title}: Date range {start_date.strftime('%d.%m.%Y')} - {end_date.strftime('%d.%m.%Y %H:%M:%S')}")
-                print(f"Total activities found: {len(all_activities)}")
-                print(f"Yoga activities: {yoga_count}")
-                print(f"Workout activities: {workout_count}")
-                if yoga_activities:
-                    print(f"Yoga activity dates: {[activity['start_date_local'] for activity in yoga_activities]}")
-
-                # Collect updates for this worksheet
-                all_updates.append((ws, 'P7', yoga_count))
-                all_updates.append((ws, 'P4', workout_count))
-                
-                print(f"Collected updates for worksheet {ws.title}: P7={yoga_count}, P4={workout_count}")
-                
+                weeks.append((start_date, end_date, ws.title))
         except Exception as e:
             print(f"Error processing worksheet {ws.title}: {e}")
             continue
-    
-    # Execute all updates in batches
-    if all_updates:
-        print(f"Executing {len(all_updates)} P4/P7 updates...")
-        
-        # Group updates by worksheet to minimize API calls
-        worksheet_updates = {}
-        for ws, cell, value in all_updates:
-            if ws not in worksheet_updates:
-                worksheet_updates[ws] = []
-            worksheet_updates[ws].append((cell, value))
-        
-        # Update each worksheet with its collected updates
-        for ws, updates in worksheet_updates.items():
-            try:
-                # Use batch_update with proper format: list of dicts with 'range' and 'values'
-                # The range should include the worksheet name and cell reference
-                batch_data = [{'range': f'{ws.title}!{cell}', 'values': [[value]]} for cell, value in updates]
-                ws.batch_update(batch_data)
-                print(f"Successfully updated worksheet {ws.title} with {len(updates)} cells")
-            except Exception as e:
-                print(f"Failed to batch update worksheet {ws.title}: {e}")
-                # Fallback to individual updates
-                for cell, value in updates:
-                    try:
-                        ws.update_acell(cell, value)
-                        time.sleep(0.1)  # Small delay between individual updates
-                    except Exception as fallback_e:
-                        print(f"Failed to update {cell} in {ws.title}: {fallback_e}")
+
+    if not weeks:
+        print("No finished weeks to update.")
+        return
+
+    # Get the activities of all weeks with one query over their union; a day of margin on both sides
+    # covers the offset between UTC start timestamps and the local week boundaries
+    weeks.sort()
+    all_activities = get_activities_in_timeframe(
+        strava_client, weeks[0][0] - timedelta(days=1), weeks[-1][1] + timedelta(days=1))
+
+    # Bucket the activities into the weeks by local start time with a bisect over the sorted week starts
+    week_starts = [start_date for start_date, _, _ in weeks]
+    yoga_activities_per_week = [[] for _ in weeks]
+    workout_counts = [0] * len(weeks)
+    for activity in all_activities:
+        if activity['sport_type'] not in ("Yoga", "Workout"):
+            continue
+        start_date_local = datetime.strptime(activity['start_date_local'], "%Y-%m-%dT%H:%M:%SZ")
+        week = bisect_right(week_starts, start_date_local) - 1
+        if week < 0 or start_date_local > weeks[week][1]:
+            continue
+        if activity['sport_type'] == "Yoga":
+            yoga_activities_per_week[week].append(activity)
+        else:
+            workout_counts[week] += 1
+
+    # Collect all updates to do them in one batch
+    all_updates = []
+    for (start_date, end_date, worksheet_title), yoga_activities, workout_count in zip(
+            weeks, yoga_activities_per_week, workout_counts):
+        yoga_count = len(yoga_activities)
+
+        # Debug information
+        print(f"Worksheet {worksheet_title}: Date range {start_date.strftime('%d.%m.%Y')} - {end_date.strftime('%d.%m.%Y %H:%M:%S')}")
+        print(f"Yoga activities: {yoga_count}")
+        print(f"Workout activities: {workout_count}")
+        if yoga_activities:
+            print(f"Yoga activity dates: {[activity['start_date_local'] for activity in yoga_activities]}")
+
+        # Collect updates for this worksheet
+        all_updates.append((worksheet_title, 'P7', yoga_count))
+        all_updates.append((worksheet_title, 'P4', workout_count))
+
+    # Execute all updates in one batch across the worksheets; throttling is retried by the Sheets request scheduler
+    print(f"Executing {len(all_updates)} P4/P7 updates...")
+    sheets_client.write_cells(all_updates)
+
+def get_weekly_stream_aggregates(strava_client, start_date, end_date):
+    """
+    Computes per-week training aggregates from the activity streams in a given timeframe.
+    Missing streams are fetched into the columnar stream store first; if the rate limit stops
+    that early, an exception is raised instead of aggregating incomplete weeks.
+
+    Args:
+        strava_client (StravaClient): An instance of the StravaClient class.
+        start_date (datetime): The start date of the timeframe.
+        end_date (datetime): The end date of the timeframe.
+
+    Returns:
+        list: One dict of aggregates per Sunday-Saturday week.
+    """
+    activities = get_activities_in_timeframe(strava_client, start_date, end_date)
+    strava_client.sync_activity_streams(activities)
+    stream_store = strava_client.get_stream_store()
+    missing_count = sum(1 for activity in activities if activity['id'] not in stream_store)
+    if missing_count:
+        raise Exception(f"Streams of {missing_count} activities are still missing, run again after the rate limit resets")
+    return stream_store.weekly_aggregates(start_date, end_date)
 
 def update_activities_since_first_not_completed_day(sheets_client, strava_client):
     # Get the first not completed day
@@ -184,13 +217,160 @@ def update_activities_since_first_not_completed_day(sheets_client, strava_client
     # Update the sheets with activity details
     update_sheets_with_activity_details(sheets_client, strava_client, activities)
 
+def update_activities_incrementally(sheets_client, strava_client, lookback_days=7):
+    """
+    Updates the sheets with the activities since the newest one the ledger records as written.
+    The lookback for late uploads never reaches before the oldest ledger entry or the first not completed day:
+    activities written by runs before the ledger existed are not in it and would be added a second time.
+    With an empty ledger the sync starts at the first not completed day, as the full sync does.
+
+    Args:
+        sheets_client (SheetsClient): An instance of the SheetsClient class.
+        strava_client (StravaClient): An instance of the StravaClient class.
+        lookback_days (int): How many days before the newest written activity to look for late uploads.
+    """
+    ledger = sheets_client.get_ledger()
+    start_date = get_first_not_completed_day(sheets_client)
+    latest_start_date = ledger.get_latest_start_date()
+    if latest_start_date is not None:
+        lookback_start = datetime.strptime(latest_start_date, "%Y-%m-%dT%H:%M:%SZ") - timedelta(days=lookback_days)
+        earliest_start = datetime.strptime(ledger.get_earliest_start_date(), "%Y-%m-%dT%H:%M:%SZ")
+        start_date = max(lookback_start, earliest_start, start_date)
+
+    # Get all activities in the timeframe up to the current date
+    activities = get_activities_in_timeframe(strava_client, start_date, datetime.now())
+
+    # Filter out yoga activities
+    activities = filter_out_yoga_activities(activities)
+
+    # Update the sheets with activity details
+    update_sheets_with_activity_details(sheets_client, strava_client, activities)
+
+def update_sheets_with_pending_webhook_activities(sheets_client, strava_client):
+    """
+    Updates the sheets with the activities the Strava webhook reported as created since the last run.
+
+    Args:
+        sheets_client (SheetsClient): An instance of the SheetsClient class.
+        strava_client (StravaClient): An instance of the StravaClient class.
+    """
+    store = strava_client.get_activity_store()
+    activity_ids = store.get_pending_activity_ids(SHEETS_PIPELINE)
+    if not activity_ids:
+        print("No pending webhook activities for the sheets.")
+        return
+
+    print(f"Updating sheets with {len(activity_ids)} pending webhook activities...")
+    # Fetched one by one, so an activity that was deleted or made private doesn't block the others
+    activities_details = []
+    for activity_id in activity_ids:
+        try:
+            activities_details.append(
+                strava_client.get_strava_data_for_activity_with_specific_ID(activity_id, False))
+        except HTTPError as e:
+            if e.response is None or e.response.status_code not in (403, 404):
+                raise
+            print(f"Activity {activity_id} is no longer available on Strava ({e.response.status_code}), dropping it.")
+
+    # Write the activities in the order they happened and leave out yoga like the timeframe sync,
+    # so a week with only yoga gets no week worksheet either
+    activities_details = filter_out_yoga_activities(activities_details)
+    activities_details.sort(key=lambda activity: activity['start_date'])
+    sheets_client.prepare_week_worksheets_for_activities(activities_details)
+    with sheets_client.buffered_writes():
+        for activity_details in activities_details:
+            sheets_client.set_new_entry_from_json(activity_details)
+
+    store.mark_processed(activity_ids, SHEETS_PIPELINE)
+
+def transfer_pending_webhook_activities_to_Garmin(strava_client, garmin_client, driver, wait):
+    """
+    Transfers the activities the Strava webhook reported as created or edited to Garmin.
+    Walks back from the newest Garmin activity until every pending activity was visited or
+    the walk passed the oldest of them.
+
+    Args:
+        strava_client (StravaClient): An instance of the StravaClient class.
+        garmin_client (GarminClient): An instance of the GarminClient class.
+        driver: The Selenium WebDriver instance.
+        wait: The WebDriverWait instance.
+    """
+    store = strava_client.get_activity_store()
+
+    # Created activities have to be in the store before they can be matched
+    strava_client.sync_activity_store()
+    pending_activities = []
+    dropped_ids = []
+    for activity_id in store.get_pending_activity_ids(GARMIN_PIPELINE):
+        activity = store.get_activity(activity_id)
+        # Activities missing from the store and manual entries never show up on Garmin
+        if activity is None or activity.get('manual'):
+            dropped_ids.append(activity_id)
+        else:
+            pending_activities.append(activity)
+    if dropped_ids:
+        print(f"Dropping {len(dropped_ids)} pending activities that can't be found on Garmin.")
+        store.mark_processed(dropped_ids, GARMIN_PIPELINE)
+    if not pending_activities:
+        print("No pending webhook activities for Garmin.")
+        return
+
+    activity_index = ActivityMatchIndex(pending_activities)
+    oldest_start = min(datetime.strptime(activity['start_date_local'], "%Y-%m-%dT%H:%M:%SZ")
+                       for activity in pending_activities)
+    print(f"Transferring {len(pending_activities)} pending webhook activities to Garmin...")
+
+    garmin_client.login(driver, wait)
+    garmin_client.open_activity_overview(driver, wait)
+    garmin_client.click_first_activity_in_overview(driver, wait)
+
+    tolerance = timedelta(minutes=activity_index.tolerance_minutes)
+    processed_ids = []
+    date = None
+    while len(processed_ids) < len(pending_activities):
+        date = garmin_client.get_date_time_from_activity(driver, wait)
+        if not isinstance(date, datetime):
+            date = datetime(date.year, date.month, date.day)
+        if date < oldest_start - tolerance:
+            print("Walked past the oldest pending activity, stopping.")
+            break
+
+        strava_activity = activity_index.find(date, garmin_client.get_elapsed_duration_from_activity(driver))
+        if strava_activity is not None and strava_activity['id'] not in processed_ids:
+            if (strava_activity['name'] not in DEFAULT_WORKOUT_NAMES) and (
+                    garmin_client.get_name_from_activity(driver, wait) != strava_activity['name']):
+                print(f"Transferring activity: {strava_activity['name']}")
+                correspondingStravaActivity = strava_client.get_strava_data_for_activity_with_specific_ID(
+                    strava_activity['id'], False, summary=strava_activity)
+                garmin_client.edit_current_garmin_activity(driver, wait, correspondingStravaActivity)
+            processed_ids.append(strava_activity['id'])
+
+        if len(processed_ids) < len(pending_activities):
+            garmin_client.click_previous_button(driver, wait)
+
+    # Activities the walk has passed without finding them won't be found by a later run either;
+    # only those newer than where the walk stopped stay queued
+    if date is not None:
+        passed_ids = [activity['id'] for activity in pending_activities
+                      if activity['id'] not in processed_ids
+                      and datetime.strptime(activity['start_date_local'], "%Y-%m-%dT%H:%M:%SZ") - tolerance > date]
+        if passed_ids:
+            print(f"{len(passed_ids)} pending activities were not found on Garmin, dropping them.")
+        processed_ids += passed_ids
+    store.mark_processed(processed_ids, GARMIN_PIPELINE)
+    garmin_client.step_timer.report()
+
 def transfer_all_activities_not_yet_transferred_from_Strava_to_Garmin_without_stop(strava_client, garmin_client, driver, wait):
     garmin_client.login(driver, wait)
     garmin_client.open_activity_overview(driver, wait)
     garmin_client.click_first_activity_in_overview(driver, wait)
 
-    all_activities = strava_client.get_all_activities_in_timeframe("2020-01-01 00:00:00",
-                                                                   datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    # The walk reaches back through the whole history, so edits older than the delta window must be in the store too
+    strava_client.sync_activity_store(force=True, full=True)
+    all_activities = strava_client.get_stored_activities_in_timeframe(strava_client.history_start_date,
+                                                                      datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    # Parse the Strava start times once into an index for the Garmin lookups
+    activity_index = ActivityMatchIndex(all_activities)
 
     activity_count = 0
     while True:
@@ -200,25 +380,23 @@ def transfer_all_activities_not_yet_transferred_from_Strava_to_Garmin_without_st
         date_str = date.strftime("%Y-%m-%dT%H:%M:%S")
         print(f"Activity date: {date} ({date_str})")
 
-        correspondingStravaActivityWoDetails = next((activity for activity in all_activities if datetime.strptime(activity['start_date_local'],"%Y-%m-%dT%H:%M:%SZ").replace(second=0).isoformat() == date_str), None)
+        correspondingStravaActivityWoDetails = activity_index.find(
+            date, garmin_client.get_elapsed_duration_from_activity(driver))
 
         if correspondingStravaActivityWoDetails is None:
             print("No corresponding Strava activity found, skipping.")
             garmin_client.click_previous_button(driver, wait)
-            time.sleep(5)
             continue
 
-        if (correspondingStravaActivityWoDetails['name'] not in ['Afternoon Workout', 'Morning Workout', 'Evening Workout',
-                                                        'Lunch Workout', 'Night Workout']) and (
+        if (correspondingStravaActivityWoDetails['name'] not in DEFAULT_WORKOUT_NAMES) and (
                 garmin_client.get_name_from_activity(driver, wait) != correspondingStravaActivityWoDetails['name']):
 
             correspondingStravaActivity = strava_client.get_strava_data_for_activity_with_specific_ID(
-                correspondingStravaActivityWoDetails['id'], False)
+                correspondingStravaActivityWoDetails['id'], False, summary=correspondingStravaActivityWoDetails)
             print(correspondingStravaActivity)
             garmin_client.edit_current_garmin_activity(driver, wait, correspondingStravaActivity)
 
         garmin_client.click_previous_button(driver, wait)
-        time.sleep(5)  # Increased wait time between activities
 
 def transfer_activities_from_Strava_to_Garmin_until_already_transferred(strava_client, garmin_client, driver, wait):
     """
@@ -251,8 +429,10 @@ def transfer_activities_from_Strava_to_Garmin_until_already_transferred(strava_c
 
     try:
         print("Step 4: Fetching Strava activities...")
-        all_activities = strava_client.get_all_activities_in_timeframe("2020-01-01 00:00:00",
-                                                                       datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        all_activities = strava_client.get_stored_activities_in_timeframe(strava_client.history_start_date,
+                                                                          datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        # Parse the Strava start times once into an index for the Garmin lookups
+        activity_index = ActivityMatchIndex(all_activities)
         print(f"✅ Fetched {len(all_activities)} Strava activities")
     except Exception as e:
         print(f"❌ Error fetching Strava activities: {e}")
@@ -271,7 +451,8 @@ def transfer_activities_from_Strava_to_Garmin_until_already_transferred(strava_c
             date_str = date.strftime("%Y-%m-%dT%H:%M:%S")
             print(f"Processing activity from {date} ({date_str})")
 
-            correspondingStravaActivityWoDetails = next((activity for activity in all_activities if datetime.strptime(activity['start_date_local'],"%Y-%m-%dT%H:%M:%SZ").replace(second=0).isoformat() == date_str), None)
+            correspondingStravaActivityWoDetails = activity_index.find(
+                date, garmin_client.get_elapsed_duration_from_activity(driver))
         except Exception as e:
             print(f"❌ Error processing activity #{activity_count}: {e}")
             import traceback
@@ -295,37 +476,216 @@ def transfer_activities_from_Strava_to_Garmin_until_already_transferred(strava_c
             break
 
         # Skip workout activities that don't need to be transferred
-        if strava_activity_name in ['Afternoon Workout', 'Morning Workout', 'Evening Workout',
-                                   'Lunch Workout', 'Night Workout']:
+        if strava_activity_name in DEFAULT_WORKOUT_NAMES:
             print(f"Skipping workout activity: {strava_activity_name}")
         else:
             # Transfer the activity
             print(f"Transferring activity: {strava_activity_name}")
             correspondingStravaActivity = strava_client.get_strava_data_for_activity_with_specific_ID(
-                correspondingStravaActivityWoDetails['id'], False)
+                correspondingStravaActivityWoDetails['id'], False, summary=correspondingStravaActivityWoDetails)
             print(f"Strava activity data: {correspondingStravaActivity}")
             garmin_client.edit_current_garmin_activity(driver, wait, correspondingStravaActivity)
 
         garmin_client.click_previous_button(driver, wait)
-        time.sleep(5)  # Increased wait time between activities
+
+    garmin_client.step_timer.report()
+
+def transfer_activities_from_Strava_to_Garmin_via_http(strava_client, garmin_client, driver, wait,
+                                                      http_client=None, stop_at_transferred=True):
+    """
+    Transfers activity names and descriptions from Strava to Garmin through Garmin Connect's JSON endpoints.
+    The browser is only used to log in; the activity list is read and every edit is sent with plain HTTP requests.
+
+    Args:
+        strava_client (StravaClient): An instance of the StravaClient class.
+        garmin_client (GarminClient): An instance of the GarminClient class.
+        driver: The Selenium WebDriver instance.
+        wait: The WebDriverWait instance.
+        http_client (GarminHttpClient): The HTTP client to use, e.g. one pointed at a stub server.
+        stop_at_transferred (bool): Stop at the first activity whose Garmin name already matches Strava.
+    """
+    from garmin_http_client import GarminHttpClient
+
+    if http_client is None:
+        garmin_client.login(driver, wait)
+        http_client = GarminHttpClient()
+        http_client.load_session_from_driver(driver)
+
+    transferred_count = 0
+    for garmin_activity, strava_activity in find_Garmin_activities_to_transfer(strava_client, http_client,
+                                                                               stop_at_transferred):
+        print(f"Transferring activity: {strava_activity['name']}")
+        correspondingStravaActivity = strava_client.get_strava_data_for_activity_with_specific_ID(
+            strava_activity['id'], False, summary=strava_activity)
+        http_client.update_activity(garmin_activity['activityId'],
+                                    name=correspondingStravaActivity['name'],
+                                    description=correspondingStravaActivity.get('description'))
+        transferred_count += 1
+
+    print(f"✅ Transferred {transferred_count} activities to Garmin")
+    return transferred_count
+
+def find_Garmin_activities_to_transfer(strava_client, http_client, stop_at_transferred=True):
+    """
+    Matches Garmin Connect's activity list against the stored Strava activities and collects the
+    activities whose Garmin name still differs from Strava.
+
+    Args:
+        strava_client (StravaClient): An instance of the StravaClient class.
+        http_client (GarminHttpClient): A Garmin HTTP client with a signed-in session.
+        stop_at_transferred (bool): Stop at the first activity whose Garmin name already matches Strava.
+
+    Returns:
+        list: (Garmin activity, Strava activity summary) pairs, newest first.
+    """
+    all_activities = strava_client.get_stored_activities_in_timeframe(strava_client.history_start_date,
+                                                                      datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    # Parse the Strava start times once into an index for the Garmin lookups
+    activity_index = ActivityMatchIndex(all_activities)
+    print(f"✅ Fetched {len(all_activities)} Strava activities")
+
+    to_transfer = []
+    for garmin_activity in http_client.iter_activities():
+        date = http_client.get_start_time_local(garmin_activity)
+        strava_activity = activity_index.find(date, garmin_activity.get('elapsedDuration'))
+        if strava_activity is None:
+            print(f"No corresponding Strava activity found for {date}, skipping.")
+            continue
+
+        if garmin_activity.get('activityName') == strava_activity['name']:
+            if stop_at_transferred:
+                print(f"Activity already transferred (titles match): '{strava_activity['name']}', stopping.")
+                break
+            continue
+
+        # Skip workout activities that don't need to be transferred
+        if strava_activity['name'] in DEFAULT_WORKOUT_NAMES:
+            print(f"Skipping workout activity: {strava_activity['name']}")
+            continue
+
+        to_transfer.append((garmin_activity, strava_activity))
+    return to_transfer
+
+def transfer_activities_from_Strava_to_Garmin_in_parallel(strava_client, garmin_client, driver, wait, max_workers=3,
+                                                         driver_factory=None, http_client=None,
+                                                         stop_at_transferred=False):
+    """
+    Transfers activities from Strava to Garmin with several browsers at once.
+    The activities that need edits are taken from Garmin Connect's activity list. Every worker browser
+    shares the login session of the given driver, opens its activities directly by URL and edits them.
+
+    Args:
+        strava_client (StravaClient): An instance of the StravaClient class.
+        garmin_client (GarminClient): An instance of the GarminClient class.
+        driver: The Selenium WebDriver instance used to log in.
+        wait: The WebDriverWait instance.
+        max_workers (int): How many browsers edit activities at the same time.
+        driver_factory: Starts a worker browser, garmin_client.create_driver if None.
+        http_client (GarminHttpClient): The HTTP client used to list the activities.
+        stop_at_transferred (bool): Only collect the activities up to the first one already transferred.
+
+    Returns:
+        int: The number of transferred activities.
+    """
+    from garmin_client import GarminClient, create_driver
+    from garmin_http_client import GarminHttpClient
+    from garmin_session import get_browser_cookies, set_browser_cookies
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    driver_factory = driver_factory or create_driver
+    garmin_client.login(driver, wait)
+    if http_client is None:
+        http_client = GarminHttpClient()
+        http_client.load_session_from_driver(driver)
+
+    to_transfer = find_Garmin_activities_to_transfer(strava_client, http_client, stop_at_transferred)
+    if not to_transfer:
+        print("No activities to transfer to Garmin.")
+        return 0
+
+    # The Strava details are fetched up front, so the workers only drive their browsers
+    strava_details = strava_client.get_activities_details([strava_activity for _, strava_activity in to_transfer])
+    jobs = queue.Queue()
+    for (garmin_activity, _), details in zip(to_transfer, strava_details):
+        jobs.put((garmin_activity['activityId'], details))
+
+    cookies = get_browser_cookies(driver)
+    transferred_ids = []
+    failed_ids = []
+    # undetected_chromedriver patches its driver binary on startup, so browsers are started one at a time
+    driver_start_lock = threading.Lock()
+
+    def run_worker(worker_number):
+        worker_client = GarminClient(session_store=garmin_client.session_store)
+        try:
+            with driver_start_lock:
+                worker_driver = driver_factory()
+        except Exception as e:
+            # The other workers drain the queue without this one
+            print(f"❌ Worker {worker_number}: failed to start a browser: {e}")
+            return
+        worker_wait = WebDriverWait(worker_driver, 20)
+        try:
+            set_browser_cookies(worker_driver, cookies)
+            while True:
+                try:
+                    activity_id, details = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    worker_client.open_activity(worker_driver, worker_wait, activity_id)
+                    worker_client.edit_current_garmin_activity(worker_driver, worker_wait, details)
+                    transferred_ids.append(activity_id)
+                    print(f"Worker {worker_number}: transferred activity {details['name']}")
+                except Exception as e:
+                    # The activity keeps its old name, so the next run picks it up again
+                    print(f"❌ Worker {worker_number}: failed to transfer activity {activity_id}: {e}")
+                    failed_ids.append(activity_id)
+        except Exception as e:
+            print(f"❌ Worker {worker_number}: stopped: {e}")
+        finally:
+            worker_driver.quit()
+
+    start = time.perf_counter()
+    worker_count = min(max_workers, len(to_transfer))
+    print(f"Transferring {len(to_transfer)} activities to Garmin with {worker_count} browsers...")
+    with ThreadPoolExecutor(max_workers=worker_count) as executor:
+        list(executor.map(run_worker, range(1, worker_count + 1)))
+
+    print(f"✅ Transferred {len(transferred_ids)} activities to Garmin in {time.perf_counter() - start:.1f} s")
+    if failed_ids:
+        print(f"❌ {len(failed_ids)} activities failed: {failed_ids}")
+    if not jobs.empty():
+        # Happens when no browser could be started; the activities are picked up by the next run
+        print(f"❌ {jobs.qsize()} activities were not attempted")
+    return len(transferred_ids)
 
 def main():
     """
     The main function of the script.
     """
+    # The Sheets and browser stacks are imported here, so tasks that don't need them start quickly
+    from garmin_client import GarminClient, create_driver
+    from sheets_client import SheetsClient
+    from selenium.webdriver.support.ui import WebDriverWait
+
     # Create instances of the StravaClient and SheetsClient classes
     strava_client = StravaClient()
     sheets_client = SheetsClient()
     garmin_client = GarminClient()
 
-    driver = uc.Chrome(headless=False, use_subprocess=False)
+    driver = create_driver()
     wait = WebDriverWait(driver, 20)
 
     # update_activities_since_first_not_completed_day(sheets_client, strava_client)
 
     # update_p4_p7_worksheets(sheets_client, strava_client)
 
-    # Use the new function that stops when it finds an already transferred activity
+    # Drain what a running Strava webhook receiver queued in the local activity store since the last run
+    update_sheets_with_pending_webhook_activities(sheets_client, strava_client)
+
+    # Edits of older activities the webhook reported, then the new activities up to the first already transferred one
+    transfer_pending_webhook_activities_to_Garmin(strava_client, garmin_client, driver, wait)
     transfer_activities_from_Strava_to_Garmin_until_already_transferred(strava_client, garmin_client, driver, wait)
     
     # Alternative: Use the original function that doesn't stop
@@ -0,0 +1,111 @@
+import sqlite3
+import time
+
+
+class SheetLedger:
+    """
+    A local record of the Strava activities already written to the training diary and the
+    cells each of them contributed to, backed by SQLite.
+    Since diary entries are additive, an activity must never be written twice.
+    """
+    def __init__(self, db_file="sheet_ledger.db"):
+        self.db_file = db_file
+        self._connection = sqlite3.connect(self.db_file)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS synced_activities (
+                activity_id INTEGER PRIMARY KEY,
+                worksheet_title TEXT NOT NULL,
+                start_date_local TEXT NOT NULL,
+                synced_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS synced_cells (
+                activity_id INTEGER NOT NULL,
+                cell TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (activity_id, cell)
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_synced_activities_start ON synced_activities (start_date_local)")
+        self._connection.commit()
+
+    def __contains__(self, activity_id):
+        row = self._connection.execute(
+            "SELECT 1 FROM synced_activities WHERE activity_id = ?", (activity_id,)).fetchone()
+        return row is not None
+
+    def get_synced_ids(self, activity_ids):
+        """
+        Get the subset of the given activity IDs that were already written to the diary
+        """
+        activity_ids = list(activity_ids)
+        synced_ids = set()
+        # Stay below SQLite's limit of bound parameters per statement
+        for i in range(0, len(activity_ids), 500):
+            chunk = activity_ids[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._connection.execute(
+                f"SELECT activity_id FROM synced_activities WHERE activity_id IN ({placeholders})", chunk)
+            synced_ids.update(row[0] for row in rows)
+        return synced_ids
+
+    def record_activities(self, entries):
+        """
+        Record activities whose cell updates were written to the diary.
+
+        Args:
+            entries (list): Dicts with activity_id, worksheet_title, start_date_local and
+            cells, a dict of the value each cell received from the activity.
+        """
+        if not entries:
+            return
+        synced_at = time.time()
+        with self._connection:
+            for entry in entries:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO synced_activities (activity_id, worksheet_title, start_date_local, synced_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (entry['activity_id'], entry['worksheet_title'], entry['start_date_local'], synced_at),
+                )
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO synced_cells (activity_id, cell, value) VALUES (?, ?, ?)",
+                    [(entry['activity_id'], cell, str(value)) for cell, value in entry['cells'].items()],
+                )
+
+    def get_cells(self, activity_id):
+        """
+        Get the worksheet title and the contributed cell values of a synced activity, or None
+        """
+        row = self._connection.execute(
+            "SELECT worksheet_title FROM synced_activities WHERE activity_id = ?", (activity_id,)).fetchone()
+        if row is None:
+            return None
+        cells = dict(self._connection.execute(
+            "SELECT cell, value FROM synced_cells WHERE activity_id = ?", (activity_id,)).fetchall())
+        return {'worksheet_title': row[0], 'cells': cells}
+
+    def get_latest_start_date(self):
+        """
+        Get the local start time of the newest synced activity, or None if the ledger is empty
+        """
+        row = self._connection.execute("SELECT MAX(start_date_local) FROM synced_activities").fetchone()
+        return row[0]
+
+    def get_earliest_start_date(self):
+        """
+        Get the local start time of the oldest synced activity, or None if the ledger is empty
+        """
+        row = self._connection.execute("SELECT MIN(start_date_local) FROM synced_activities").fetchone()
+        return row[0]
+
+    def count(self):
+        return self._connection.execute("SELECT COUNT(*) FROM synced_activities").fetchone()[0]
+
+    def close(self):
+        self._connection.close()
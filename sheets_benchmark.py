@@ -0,0 +1,172 @@
+import argparse
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import main_app
+import sheets_client
+from fake_sheets import FakeSheetsHTTPClient, SimulatedClock, create_fake_spreadsheet
+from sheets_client import SheetsClient, SheetsRequestScheduler
+
+
+class FakeStravaClient:
+    """
+    Serves synthetic activities to the main_app functions instead of the Strava API
+    """
+    def __init__(self, activities):
+        self.activities = activities
+
+    def get_activities_details(self, activities, include_efforts=False, max_workers=4):
+        # Like StravaClient, accept activity IDs or activity summaries
+        activities_by_id = {activity['id']: activity for activity in self.activities}
+        return [dict(activity if isinstance(activity, dict) else activities_by_id[activity]) for activity in activities]
+
+    def get_stored_activities_in_timeframe(self, start_date, end_date):
+        start = datetime.strptime(start_date, '%Y-%m-%d %H:%M:%S')
+        end = datetime.strptime(end_date, '%Y-%m-%d %H:%M:%S')
+        return [activity for activity in self.activities
+                if start < datetime.strptime(activity['start_date_local'], "%Y-%m-%dT%H:%M:%SZ") < end]
+
+
+def make_activities(first_day, days):
+    """
+    One activity per day, alternating runs and other sports between morning and evening
+    """
+    activities = []
+    for i in range(days):
+        start = first_day + timedelta(days=i, hours=8 if i % 2 == 0 else 18)
+        sport_type = ['Run', 'Run', 'Workout', 'Yoga', 'Ride'][i % 5]
+        activities.append({
+            'id': 1000 + i,
+            'name': f"{sport_type} {i}",
+            'description': 'locker' if sport_type == 'Run' else '',
+            'sport_type': sport_type,
+            'distance': 5000 + 250 * i,
+            'moving_time': 1800 + 60 * i,
+            'start_date': start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            'start_date_local': start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        })
+    return activities
+
+
+class BenchmarkSetup:
+    """
+    A fresh in-memory diary with existing week worksheets, wired into sheets_client
+    """
+    def __init__(self, existing_weeks, first_week_start, filled_p4_p7_weeks, state_directory):
+        self.clock = SimulatedClock()
+        self.fake_client = FakeSheetsHTTPClient(self.clock)
+        self.fake_client.add_sheet("Übersicht", {"A1": "Woche", "K1": "Link"})
+        self.fake_client.add_sheet("leer", {"B1": "KW", "P3": "Workouts", "P6": "Yoga"})
+
+        # The scheduler has to be in place before the client is created, since the client keeps a reference to it
+        self.scheduler = SheetsRequestScheduler(sleep=self.clock.sleep, clock=self.clock.monotonic)
+        sheets_client.set_spreadsheet(self.scheduler.call(create_fake_spreadsheet, self.fake_client), self.scheduler)
+
+        self.sheets_client = SheetsClient()
+        self.sheets_client.worksheet_index_file = os.path.join(state_directory, "worksheet_index.json")
+        self.sheets_client.ledger_file = os.path.join(state_directory, "sheet_ledger.db")
+
+        for week in range(existing_weeks):
+            week_start = first_week_start + timedelta(weeks=week)
+            title, week_number, _ = self.sheets_client._get_week_info(week_start)
+            cells = {"B1": self.sheets_client._get_week_header(week_number, week_start)}
+            if week < filled_p4_p7_weeks:
+                cells.update({"P4": "2", "P7": "1"})
+            # Like the real diary, the newest week worksheet comes right after the overview and the template
+            sheet = self.fake_client.add_sheet(title, cells, index=2)
+            self.fake_client.get_sheet("Übersicht").cells[(week + 1, 0)] = title
+            self.fake_client.get_sheet("Übersicht").cells[(week + 1, 10)] = \
+                f'=HYPERLINK("https://docs.google.com/spreadsheets/d/fake-spreadsheet/edit#gid={sheet.sheet_id}";"{title}")'
+
+        # Opening the spreadsheet is not part of what is measured
+        self.fake_client.reset_calls()
+        self.started_at = self.clock.monotonic()
+
+    def report(self, name, activities):
+        counts = self.fake_client.call_counts()
+        api_calls = sum(count for latency_class, count in counts.items() if latency_class != 'throttled')
+        wall_time = self.clock.monotonic() - self.started_at
+        return {
+            'name': name,
+            'activities': activities,
+            'api_calls': api_calls,
+            'throttled': counts.get('throttled', 0),
+            'wall_seconds': wall_time,
+            'sleep_seconds': self.clock.slept,
+            'calls_per_activity': api_calls / activities if activities else None,
+            'seconds_per_activity': wall_time / activities if activities else None,
+        }
+
+
+def benchmark_set_new_entry_from_json(args, state_directory):
+    # Every entry written on its own, as the webhook path does for a single activity
+    first_week_start = datetime(2024, 1, 7)
+    setup = BenchmarkSetup(args.existing_weeks, first_week_start, args.existing_weeks, state_directory)
+    activities = make_activities(first_week_start + timedelta(weeks=args.existing_weeks - 2), args.days)
+    for activity in main_app.filter_out_yoga_activities(activities):
+        setup.sheets_client.set_new_entry_from_json(activity)
+    return setup.report("set_new_entry_from_json", len(activities))
+
+
+def benchmark_update_sheets_with_activity_details(args, state_directory):
+    # The batched timeframe sync: one grid read, one batchUpdate for new weeks, one write
+    first_week_start = datetime(2024, 1, 7)
+    setup = BenchmarkSetup(args.existing_weeks, first_week_start, args.existing_weeks, state_directory)
+    activities = make_activities(first_week_start + timedelta(weeks=args.existing_weeks - 2), args.days)
+    main_app.update_sheets_with_activity_details(
+        setup.sheets_client, FakeStravaClient(activities), main_app.filter_out_yoga_activities(activities))
+    return setup.report("update_sheets_with_activity_details", len(activities))
+
+
+def benchmark_get_empty_p4_p7_worksheets(args, state_directory):
+    first_week_start = datetime(2021, 1, 3)
+    filled_weeks = args.existing_weeks - args.empty_p4_p7_weeks
+    setup = BenchmarkSetup(args.existing_weeks, first_week_start, filled_weeks, state_directory)
+    setup.sheets_client.get_empty_p4_p7_worksheets()
+    return setup.report("get_empty_p4_p7_worksheets", 0)
+
+
+def benchmark_update_p4_p7_worksheets(args, state_directory):
+    first_week_start = datetime(2021, 1, 3)
+    filled_weeks = args.existing_weeks - args.empty_p4_p7_weeks
+    setup = BenchmarkSetup(args.existing_weeks, first_week_start, filled_weeks, state_directory)
+    activities = make_activities(first_week_start + timedelta(weeks=filled_weeks), args.empty_p4_p7_weeks * 7)
+    main_app.update_p4_p7_worksheets(setup.sheets_client, FakeStravaClient(activities))
+    return setup.report("update_p4_p7_worksheets", len(activities))
+
+
+BENCHMARKS = [
+    benchmark_set_new_entry_from_json,
+    benchmark_update_sheets_with_activity_details,
+    benchmark_get_empty_p4_p7_worksheets,
+    benchmark_update_p4_p7_worksheets,
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count Sheets API calls of SheetsClient against an in-memory spreadsheet")
+    parser.add_argument("--existing-weeks", type=int, default=150, help="Week worksheets already in the diary")
+    parser.add_argument("--days", type=int, default=28, help="Days of activities to sync, one activity per day")
+    parser.add_argument("--empty-p4-p7-weeks", type=int, default=8, help="Newest weeks without P4/P7 counts")
+    args = parser.parse_args()
+
+    results = []
+    for benchmark in BENCHMARKS:
+        # Each benchmark starts without a stored worksheet index or ledger
+        with tempfile.TemporaryDirectory() as state_directory:
+            results.append(benchmark(args, state_directory))
+
+    print()
+    print(f"{'benchmark':<38}{'activities':>11}{'API calls':>11}{'throttled':>11}{'wall s':>9}{'sleep s':>9}"
+          f"{'calls/act':>11}{'s/act':>8}")
+    for result in results:
+        calls_per_activity = f"{result['calls_per_activity']:.2f}" if result['activities'] else "-"
+        seconds_per_activity = f"{result['seconds_per_activity']:.2f}" if result['activities'] else "-"
+        print(f"{result['name']:<38}{result['activities']:>11}{result['api_calls']:>11}{result['throttled']:>11}"
+              f"{result['wall_seconds']:>9.1f}{result['sleep_seconds']:>9.1f}"
+              f"{calls_per_activity:>11}{seconds_per_activity:>8}")
+    return results
+
+if __name__ == "__main__":
+    main()
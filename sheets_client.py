@@ -1,6 +1,12 @@
+import json
 import locale
 import os
+import random
+import re
+import threading
 import time
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
 import gspread
@@ -8,44 +14,285 @@ import math
 
 from dotenv import load_dotenv
 from gspread.exceptions import APIError
-from gspread.utils import Dimension
+from gspread.utils import a1_to_rowcol
+
+from sheet_ledger import SheetLedger
+from worksheet_index import WorksheetIndex
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Create a Google Sheets client using the service account credentials
-import json
+# The spreadsheet handle is created on first use, so importing this module stays cheap
+_spreadsheet = None
 
-# Get service account credentials from environment variable
-file_path = os.getenv('FILE_PATH')
-if file_path and os.path.exists(file_path):
-    # If FILE_PATH is a file path, read from file
-    sa = gspread.service_account(filename=file_path)
-else:
-    # If FILE_PATH is JSON content directly, parse it
-    service_account_info = os.getenv('SERVICE_ACCOUNT_JSON')
-    if service_account_info:
-        credentials_dict = json.loads(service_account_info)
-        sa = gspread.service_account_from_dict(credentials_dict)
-    else:
-        raise ValueError("Either FILE_PATH (file path) or SERVICE_ACCOUNT_JSON (JSON content) must be provided")
-
-sh = sa.open(os.getenv('DOCUMENT_NAME'))
-
-# Set the locale to German for date formatting
-try:
-    locale.setlocale(locale.LC_ALL, 'de_DE')
-except locale.Error:
+def _set_german_locale():
+    """
+    Set the locale to German for date and number formatting
+    """
     try:
-        # Try alternative German locale formats
-        locale.setlocale(locale.LC_ALL, 'de_DE.UTF-8')
+        locale.setlocale(locale.LC_ALL, 'de_DE')
     except locale.Error:
         try:
-            locale.setlocale(locale.LC_ALL, 'de_DE.utf8')
+            # Try alternative German locale formats
+            locale.setlocale(locale.LC_ALL, 'de_DE.UTF-8')
         except locale.Error:
-            # Fall back to system default if German locale is not available
-            print("Warning: German locale not available, using system default")
-            pass
+            try:
+                locale.setlocale(locale.LC_ALL, 'de_DE.utf8')
+            except locale.Error:
+                # Fall back to system default if German locale is not available
+                print("Warning: German locale not available, using system default")
+                pass
+
+def get_spreadsheet():
+    """
+    Authenticate the service account and open the spreadsheet on first use
+    """
+    global _spreadsheet
+    if _spreadsheet is not None:
+        return _spreadsheet
+
+    # Get service account credentials from environment variable
+    file_path = os.getenv('FILE_PATH')
+    if file_path and os.path.exists(file_path):
+        # If FILE_PATH is a file path, read from file
+        sa = gspread.service_account(filename=file_path)
+    else:
+        # If FILE_PATH is JSON content directly, parse it
+        service_account_info = os.getenv('SERVICE_ACCOUNT_JSON')
+        if service_account_info:
+            credentials_dict = json.loads(service_account_info)
+            sa = gspread.service_account_from_dict(credentials_dict)
+        else:
+            raise ValueError("Either FILE_PATH (file path) or SERVICE_ACCOUNT_JSON (JSON content) must be provided")
+
+    _spreadsheet = get_request_scheduler().call(sa.open, os.getenv('DOCUMENT_NAME'))
+    _set_german_locale()
+    return _spreadsheet
+
+class SheetsRequestScheduler:
+    """
+    Paces all Google Sheets API calls to stay within the per-minute quota and retries throttled
+    or failed calls with exponential backoff and jitter, honouring the Retry-After header.
+    The sleep and clock functions can be replaced to simulate runs without waiting.
+    """
+    # Status codes worth retrying: quota exceeded and transient server errors
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    def __init__(self, requests_per_minute=60, max_retries=6, base_delay=1.0, max_delay=64.0,
+                 sleep=time.sleep, clock=time.monotonic):
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.clock = clock
+        self._lock = threading.Lock()
+        # Times of the requests sent within the last minute
+        self._request_times = deque()
+        self.requests = 0
+        self.retries = 0
+        self.sleep_seconds = 0.0
+
+    def _wait(self, seconds):
+        if seconds > 0:
+            self.sleep_seconds += seconds
+            self.sleep(seconds)
+
+    def _acquire(self):
+        # Reserve one request, waiting until the oldest request of the last minute drops out of the window
+        while True:
+            with self._lock:
+                now = self.clock()
+                while self._request_times and now - self._request_times[0] >= 60:
+                    self._request_times.popleft()
+                if len(self._request_times) < self.requests_per_minute:
+                    self._request_times.append(now)
+                    self.requests += 1
+                    return
+                wait_seconds = 60 - (now - self._request_times[0])
+            self._wait(wait_seconds)
+
+    def _get_retry_delay(self, error, attempt):
+        # Prefer the server's Retry-After, otherwise back off exponentially with full jitter
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_delay)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call a gspread function that sends one API request, pacing and retrying it as needed
+        """
+        for attempt in range(self.max_retries + 1):
+            self._acquire()
+            try:
+                return func(*args, **kwargs)
+            except APIError as e:
+                if e.code not in self.RETRY_STATUS_CODES or attempt == self.max_retries:
+                    raise
+                delay = self._get_retry_delay(e, attempt)
+                self.retries += 1
+                print(f"Sheets API returned {e.code}. Retrying in {delay:.1f} seconds...")
+                self._wait(delay)
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'sleep_seconds': round(self.sleep_seconds, 2),
+        }
+
+# Shared by every SheetsClient, since the quota applies to the service account as a whole
+_request_scheduler = SheetsRequestScheduler()
+
+def get_request_scheduler():
+    """
+    Get the scheduler all Sheets API calls go through
+    """
+    return _request_scheduler
+
+def set_spreadsheet(spreadsheet, request_scheduler=None):
+    """
+    Use the given spreadsheet instead of opening the configured one, e.g. the in-memory
+    stand-in from fake_sheets, optionally together with a scheduler on a simulated clock
+    """
+    global _spreadsheet, _request_scheduler
+    _spreadsheet = spreadsheet
+    if request_scheduler is not None:
+        _request_scheduler = request_scheduler
+
+# Title of the template worksheet new week worksheets are copied from
+TEMPLATE_WORKSHEET_TITLE = "leer"
+
+# Number of worksheets whose P4:P7 cells are read per values_batch_get (keeps the GET URL well below its limit)
+P4_P7_BATCH_SIZE = 200
+
+class WeekGrid:
+    """
+    In-memory copy of the B1:P8 block of a week worksheet
+    """
+    RANGE = "B1:P8"
+    FIRST_ROW = 1
+    FIRST_COLUMN = 2  # Column B
+    ROWS = 8
+    COLUMNS = 15  # Columns B to P
+
+    def __init__(self, values):
+        # Pad the ragged rows returned by the API to the full block, empty cells as ''
+        self._values = [[''] * self.COLUMNS for _ in range(self.ROWS)]
+        for row_index, row in enumerate(values[:self.ROWS]):
+            for column_index, value in enumerate(row[:self.COLUMNS]):
+                self._values[row_index][column_index] = value
+
+    def _position(self, cell):
+        row, column = a1_to_rowcol(cell)
+        return row - self.FIRST_ROW, column - self.FIRST_COLUMN
+
+    def get(self, cell):
+        # Empty cells are returned as None, like the batch_get results they replace
+        row_index, column_index = self._position(cell)
+        return self._values[row_index][column_index] or None
+
+    def set(self, cell, value):
+        row_index, column_index = self._position(cell)
+        self._values[row_index][column_index] = value
+
+    def get_columns(self, first_cell, last_cell):
+        """
+        Get a rectangular range column-major, as Dimension.cols reads return it
+        """
+        first_row, first_column = self._position(first_cell)
+        last_row, last_column = self._position(last_cell)
+        return [[self._values[row_index][column_index] for row_index in range(first_row, last_row + 1)]
+                for column_index in range(first_column, last_column + 1)]
+
+    def copy(self):
+        grid = WeekGrid([])
+        grid._values = [list(row) for row in self._values]
+        return grid
+
+class OverviewIndex:
+    """
+    The week titles listed in column A of the overview worksheet and the weeks linked in column K
+    """
+    def __init__(self, titles_column, links_column):
+        self.rows_by_title = {title: row for row, title in enumerate(titles_column, start=1) if title}
+        self.linked_titles = set()
+        for cell_value in links_column:
+            if 'HYPERLINK(' in str(cell_value):
+                # The link label is the last quoted argument of the formula
+                labels = re.findall(r'"([^"]*)"', str(cell_value))
+                if labels:
+                    self.linked_titles.add(labels[-1])
+        self.next_title_row = len(titles_column) + 1
+        self.next_link_row = len(links_column) + 1
+
+    def add(self, worksheet_title, hyperlink_formula):
+        """
+        Reserve the overview rows for a new week and get the cell updates it needs
+
+        Returns:
+            list: (cell, value) pairs for the title in column A and the hyperlink in column K.
+        """
+        updates = []
+        if worksheet_title not in self.rows_by_title:
+            updates.append((f"A{self.next_title_row}", worksheet_title))
+            self.rows_by_title[worksheet_title] = self.next_title_row
+            self.next_title_row += 1
+        if worksheet_title not in self.linked_titles:
+            updates.append((f"K{self.next_link_row}", hyperlink_formula))
+            self.linked_titles.add(worksheet_title)
+            self.next_link_row += 1
+        return updates
+
+class SheetWriteBuffer:
+    """
+    Collects cell changes across worksheets in memory, so they can be written in one request
+    """
+    def __init__(self):
+        # Current value per (worksheet title, cell), in the order the cells were first changed
+        self._values = {}
+        # Ledger entries of the activities whose updates are in the buffer
+        self._ledger_entries = {}
+
+    def has(self, worksheet_title, cell):
+        return (worksheet_title, cell) in self._values
+
+    def get(self, worksheet_title, cell):
+        return self._values.get((worksheet_title, cell))
+
+    def set(self, worksheet_title, cell, value):
+        self._values[(worksheet_title, cell)] = value
+
+    def has_changes(self):
+        return bool(self._values)
+
+    def add_ledger_entry(self, entry):
+        self._ledger_entries[entry['activity_id']] = entry
+
+    def has_activity(self, activity_id):
+        return activity_id in self._ledger_entries
+
+    def get_ledger_entries(self):
+        return list(self._ledger_entries.values())
+
+    def clear(self):
+        self._values = {}
+        self._ledger_entries = {}
+
+    def get_batch_update_body(self):
+        """
+        Build the request body for a spreadsheet-level values_batch_update
+        """
+        return {
+            'valueInputOption': 'RAW',
+            'data': [{'range': f"'{worksheet_title}'!{cell}", 'values': [[value]]}
+                     for (worksheet_title, cell), value in self._values.items()],
+        }
 
 class SheetsClient:
     """
@@ -57,17 +304,18 @@ class SheetsClient:
         """
         print("Getting first not completed day...")
 
-        # Get the latest week worksheet
-        latestWeekWorksheet = sh.worksheets()[2]
+        # Get the latest week worksheet and load its grid
+        latestWeekWorksheet = self._get_worksheets_cached()[2]
+        grid = self._get_week_grid(latestWeekWorksheet.title)
 
         # Extract the week and timeframe from cell B1
-        weekAndTimeframe = latestWeekWorksheet.acell("B1").value.split()
+        weekAndTimeframe = grid.get("B1").split()
 
         # Parse the week start date from the extracted timeframe
         weekStartDate = datetime.strptime(weekAndTimeframe[3], '%d.%m.%Y')
 
         # Get the data range from B3:O8, column-major
-        data_range = latestWeekWorksheet.get(range_name='B3:O8', major_dimension=Dimension.cols)
+        data_range = grid.get_columns("B3", "O8")
 
         # Remove empty rows from the data range
         while data_range:
@@ -82,77 +330,109 @@ class SheetsClient:
         return first_not_completed_day
 
     def __init__(self):
-        # Cache for worksheets to avoid repeated API calls
-        self._worksheets_cache = None
-        self._worksheets_cache_timestamp = None
-        self._cache_validity_minutes = 5  # Cache is valid for 5 minutes
-    
-    def _get_worksheets_cached(self):
+        # Title → worksheet properties map that is kept between runs
+        self.worksheet_index_file = "worksheet_index.json"
+        self._worksheet_index = None
+        # Whether the index was rebuilt from the spreadsheet metadata in this run
+        self._worksheet_index_refreshed = False
+        self._worksheets = {}
+        # Titles and links of the overview worksheet, loaded once per run
+        self._overview_index = None
+        # Write-behind buffer that is active inside buffered_writes()
+        self._write_buffer = None
+        # In-memory B1:P8 grids of the week worksheets, by title
+        self._week_grids = {}
+        # All Sheets API calls are paced and retried by the shared scheduler
+        self._scheduler = get_request_scheduler()
+        # Local record of the activities already written to the diary
+        self.ledger_file = "sheet_ledger.db"
+        self._ledger = None
+
+    def get_ledger(self):
         """
-        Get worksheets with caching to reduce API calls
+        Get the ledger of activities already written to the diary, opening it on first use
         """
-        current_time = datetime.now()
-        
-        # Check if cache is still valid
-        if (self._worksheets_cache is not None and 
-            self._worksheets_cache_timestamp is not None and
-            (current_time - self._worksheets_cache_timestamp).total_seconds() < self._cache_validity_minutes * 60):
-            return self._worksheets_cache
-        
-        # Cache expired or doesn't exist, fetch fresh data
-        print("Fetching fresh worksheets list...")
-        try:
-            self._worksheets_cache = sh.worksheets()
-            self._worksheets_cache_timestamp = current_time
-            return self._worksheets_cache
-        except APIError as e:
-            if e.code == 429:  # Rate limit exceeded
-                print("Rate limit exceeded while fetching worksheets list. Waiting 60 seconds...")
-                time.sleep(60)
-                # Retry once
-                try:
-                    self._worksheets_cache = sh.worksheets()
-                    self._worksheets_cache_timestamp = current_time
-                    return self._worksheets_cache
-                except Exception as retry_e:
-                    print(f"Failed to fetch worksheets after retry: {retry_e}")
-                    raise
+        if self._ledger is None:
+            self._ledger = SheetLedger(self.ledger_file)
+        return self._ledger
+
+    def filter_unsynced_activities(self, activities):
+        """
+        Leave out the activities the ledger already records as written to the diary
+        """
+        synced_ids = self.get_ledger().get_synced_ids(activity['id'] for activity in activities)
+        if synced_ids:
+            print(f"Skipping {len(synced_ids)} activities that are already in the diary")
+        return [activity for activity in activities if activity['id'] not in synced_ids]
+
+    def _get_worksheet_index(self):
+        """
+        Get the worksheet index, using the stored one without any API call if there is one
+        """
+        if self._worksheet_index is None:
+            worksheet_index = WorksheetIndex(self.worksheet_index_file)
+            self._worksheet_index = worksheet_index
+            if len(worksheet_index) > 0:
+                print(f"Using stored worksheet index with {len(worksheet_index)} worksheets")
             else:
-                raise
-    
-    def _clear_worksheets_cache(self):
+                self._refresh_worksheet_index()
+        return self._worksheet_index
+
+    def _refresh_worksheet_index(self):
+        """
+        Rebuild the worksheet index from one fetch_sheet_metadata call
+        """
+        print("Fetching worksheet metadata...")
+        if self._worksheet_index is None:
+            self._worksheet_index = WorksheetIndex(self.worksheet_index_file)
+        sheet_metadata = self._scheduler.call(get_spreadsheet().fetch_sheet_metadata)
+        self._worksheet_index.rebuild(sheet_metadata)
+        self._worksheet_index_refreshed = True
+        self._worksheets = {}
+
+    def _rebuild_stale_worksheet_index(self, error):
         """
-        Clear the worksheets cache (call this when creating new worksheets)
+        Rebuild a worksheet index from an earlier run after the API rejected one of its ranges or sheet IDs,
+        e.g. because the worksheet was deleted. Returns False if the index can't be the cause of the error.
         """
-        self._worksheets_cache = None
-        self._worksheets_cache_timestamp = None
+        if error.code != 400 or self._worksheet_index_refreshed:
+            return False
+        print(f"The stored worksheet index is outdated ({error}), rebuilding it...")
+        self._refresh_worksheet_index()
+        return True
 
-    def set_new_entry_from_json(self, activityDetails):
+    def _get_worksheet(self, worksheet_title):
         """
-        Set a new entry in the Google Sheets from a JSON object
+        Get the worksheet with the given title from the index without an API call, or None if it doesn't exist.
+        A title the stored index doesn't know rebuilds it once, since the worksheet may have been added since.
         """
-        print("Setting new entry from JSON...")
+        properties = self._get_worksheet_index().get(worksheet_title)
+        if properties is None and not self._worksheet_index_refreshed:
+            self._refresh_worksheet_index()
+            properties = self._worksheet_index.get(worksheet_title)
+        if properties is None:
+            return None
+        if worksheet_title not in self._worksheets:
+            spreadsheet = get_spreadsheet()
+            self._worksheets[worksheet_title] = gspread.Worksheet(spreadsheet, properties, spreadsheet.id, spreadsheet.client)
+        return self._worksheets[worksheet_title]
 
-        # Extract the date from the activity details
-        date_str = activityDetails['start_date_local']
-        date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+    def _get_worksheets_cached(self):
+        """
+        Get all worksheets in spreadsheet order from the worksheet index
+        """
+        return [self._get_worksheet(properties['title']) for properties in self._get_worksheet_index().get_all()]
 
+    def _get_week_info(self, date):
+        """
+        Get the worksheet title, week number and Sunday start of the week a date falls into
+        """
         # Calculate the week number and worksheet title for Sunday-Saturday weeks
         # Get the start of the week (Sunday) for the given date
         days_since_sunday = (date.weekday() + 1) % 7  # Convert Monday=0 to Sunday=0
         week_start = date - timedelta(days=days_since_sunday)
-        
-        # Calculate week number based on Sunday-Saturday weeks
-        # Use the year of the week start date
-        year = week_start.year
-        # Calculate week number: week of year starting from first Sunday
-        first_sunday_of_year = datetime(year, 1, 1)
-        days_to_first_sunday = (6 - first_sunday_of_year.weekday()) % 7
-        if days_to_first_sunday == 0 and first_sunday_of_year.weekday() != 6:
-            days_to_first_sunday = 7
-        first_sunday_of_year += timedelta(days=days_to_first_sunday)
-
-                # Calculate the week number and worksheet title
+
+        # Calculate the week number and worksheet title
         week_number = date.isocalendar()[1]
         
         # If the weekday is Sunday, increment the week number by 1
@@ -160,90 +440,293 @@ class SheetsClient:
             week_number += 1
 
         worksheet_title = f"KW{week_number}{week_start.strftime('%y')}"
+        return worksheet_title, week_number, week_start
+
+    def _get_week_header(self, week_number, week_start):
+        # Header of a week worksheet with its Sunday-Saturday range
+        week_end = week_start + timedelta(days=6)
+        return f"KW {week_number}{week_start.strftime('%y')} - {week_start:%d.%m.%Y} - {week_end:%d.%m.%Y}"
+
+    def _get_overview_index(self):
+        """
+        Get the index of the overview worksheet, reading its title and link columns on first use
+        """
+        if self._overview_index is None:
+            response = self._scheduler.call(
+                get_spreadsheet().values_batch_get,
+                ["'Übersicht'!A:A", "'Übersicht'!K:K"],
+                params={'valueRenderOption': 'FORMULA', 'majorDimension': 'COLUMNS'},
+            )
+            columns = [value_range.get('values', [[]]) for value_range in response.get('valueRanges', [])]
+            cell_list_A = columns[0][0] if columns and columns[0] else []
+            cell_list_K = columns[1][0] if len(columns) > 1 and columns[1] else []
+            self._overview_index = OverviewIndex(cell_list_A, cell_list_K)
+        return self._overview_index
 
-        # Get the list of existing worksheets from cache
-        worksheets = self._get_worksheets_cached()
+    def _plan_week_worksheet_requests(self, missing_weeks):
+        """
+        Build the batchUpdate requests that duplicate the template for every missing week
+        and set the week headers
 
+        Returns:
+            list: The requests, oldest week first so the newest worksheet ends up at index 2.
+            dict: The sheet ID chosen for each new worksheet title.
+        """
+        template_worksheet = self._get_worksheet(TEMPLATE_WORKSHEET_TITLE)
+
+        # Sheet IDs are chosen here, so the header requests and overview links can refer to the new worksheets
+        next_sheet_id = max(properties['sheetId'] for properties in self._get_worksheet_index().get_all()) + 1
+
+        requests = []
+        sheet_ids = {}
+        for worksheet_title, week_number, week_start in missing_weeks:
+            sheet_id = next_sheet_id
+            next_sheet_id += 1
+            sheet_ids[worksheet_title] = sheet_id
+            requests.append({
+                'duplicateSheet': {
+                    'sourceSheetId': template_worksheet.id,
+                    'insertSheetIndex': 2,
+                    'newSheetId': sheet_id,
+                    'newSheetName': worksheet_title,
+                }
+            })
+            requests.append({
+                'updateCells': {
+                    'rows': [{'values': [{'userEnteredValue': {
+                        'stringValue': self._get_week_header(week_number, week_start)}}]}],
+                    'fields': 'userEnteredValue',
+                    'start': {'sheetId': sheet_id, 'rowIndex': 0, 'columnIndex': 1},
+                }
+            })
+        return requests, sheet_ids
+
+    def _add_weeks_to_overview(self, sheet_ids):
+        """
+        Add the titles and hyperlinks of new week worksheets to the overview worksheet
+        with one USER_ENTERED write, so the formulas are evaluated
+        """
+        overview_index = self._get_overview_index()
+        overview_updates = []
+        for worksheet_title, sheet_id in sheet_ids.items():
+            worksheet_url = f"https://docs.google.com/spreadsheets/d/{get_spreadsheet().id}/edit#gid={sheet_id}"
+            # Use proper HYPERLINK formula syntax with semicolon separator
+            hyperlink_formula = f'=HYPERLINK("{worksheet_url}";"{worksheet_title}")'
+            overview_updates.extend(overview_index.add(worksheet_title, hyperlink_formula))
+        if not overview_updates:
+            return
+
+        self._scheduler.call(get_spreadsheet().values_batch_update, {
+            'valueInputOption': 'USER_ENTERED',
+            'data': [{'range': f"'Übersicht'!{cell}", 'values': [[value]]} for cell, value in overview_updates],
+        })
+        print(f"Updated {len(overview_updates)} overview cells in one request")
+
+    def create_week_worksheets(self, weeks):
+        """
+        Create every week worksheet that doesn't exist yet from the template with a single
+        spreadsheet batchUpdate, including the week headers, and list them in the overview.
+
+        Args:
+            weeks (list): (worksheet title, week number, week start) tuples as returned by _get_week_info.
+
+        Returns:
+            list: The titles of the worksheets that were created.
+        """
+        # Try to create the worksheets, handle race conditions with other runs
+        max_retries = 3
+        for attempt in range(max_retries):
+            worksheet_index = self._get_worksheet_index()
+            missing_weeks = sorted(
+                {week[0]: week for week in weeks if week[0] not in worksheet_index}.values(),
+                key=lambda week: week[2],
+            )
+            if not missing_weeks:
+                return []
+
+            print(f"Creating {len(missing_weeks)} new worksheets: {', '.join(week[0] for week in missing_weeks)}")
+            requests, sheet_ids = self._plan_week_worksheet_requests(missing_weeks)
+            try:
+                response = self._scheduler.call(get_spreadsheet().batch_update, {'requests': requests})
+                break  # Success, exit retry loop
+            except APIError as e:
+                if attempt == max_retries - 1:
+                    raise  # Out of retries
+                if "already exists" in str(e):
+                    print(f"A new worksheet already exists, retrying... (attempt {attempt + 1})")
+                    # Refresh the indexes so worksheets created in the meantime are skipped
+                    self._refresh_worksheet_index()
+                    self._overview_index = None
+                elif not self._rebuild_stale_worksheet_index(e):
+                    raise  # Re-raise if it's neither a duplicate error nor an outdated template sheet ID
+
+        # Record the new worksheets right away, so later lookups don't need the metadata again
+        for reply in response.get('replies', []):
+            if 'duplicateSheet' in reply:
+                worksheet_index.add(reply['duplicateSheet']['properties'])
+        worksheet_index.save()
+        self._add_weeks_to_overview(sheet_ids)
+
+        # A worksheet duplicated from the template starts out as a copy of it, so its grid doesn't need to be read
+        self.load_week_grids([])
+        for worksheet_title, week_number, week_start in missing_weeks:
+            self._week_grids[worksheet_title] = self._week_grids[TEMPLATE_WORKSHEET_TITLE].copy()
+            self._week_grids[worksheet_title].set("B1", self._get_week_header(week_number, week_start))
+        print(f"Created {len(missing_weeks)} worksheets")
+        return [week[0] for week in missing_weeks]
+
+    def _get_or_create_week_worksheet(self, worksheet_title, week_number, week_start):
+        """
+        Get the week worksheet with the given title, creating it if it doesn't exist yet
+        """
         # Check if the worksheet already exists
-        existing_worksheet = next((ws for ws in worksheets if ws.title == worksheet_title), None)
-        
-        # If worksheet doesn't exist, clear cache immediately to prevent race conditions
-        if existing_worksheet is None:
-            self._clear_worksheets_cache()
-
-        if existing_worksheet is None:
-            print("Creating new worksheet:", worksheet_title)
-            
-            # Try to create the worksheet, handle race conditions
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    # Create a new worksheet from a template
-                    template_worksheet = sh.worksheet("leer")
-                    new_worksheet = sh.duplicate_sheet(source_sheet_id=template_worksheet.id, insert_sheet_index=2,
-                                                       new_sheet_name=worksheet_title)
-                    break  # Success, exit retry loop
-                except APIError as e:
-                    if "already exists" in str(e) and attempt < max_retries - 1:
-                        print(f"Worksheet {worksheet_title} already exists, retrying... (attempt {attempt + 1})")
-                        # Clear cache and try to get the existing worksheet
-                        self._clear_worksheets_cache()
-                        worksheets = self._get_worksheets_cached()
-                        existing_worksheet = next((ws for ws in worksheets if ws.title == worksheet_title), None)
-                        if existing_worksheet:
-                            print(f"Found existing worksheet {worksheet_title}, using it instead")
-                            new_worksheet = existing_worksheet
-                            break
-                        time.sleep(0.5)  # Small delay before retry
-                    else:
-                        raise  # Re-raise if it's not a duplicate error or we're out of retries
-
-            # Update the overview worksheet with the new worksheet title
-            overview_ws = sh.worksheet("Übersicht")
-            cell_list_A = overview_ws.col_values(1)
-            cell_list_K = overview_ws.col_values(11)
-
-            # Collect overview updates to do them in batch
-            overview_updates = []
-            
-            if worksheet_title not in cell_list_A:
-                next_available_row_A = len(cell_list_A) + 1
-                overview_updates.append((f"A{next_available_row_A}", worksheet_title))
-
-            # Check if hyperlink already exists in column K
-            hyperlink_exists = False
-            for i, cell_value in enumerate(cell_list_K):
-                if cell_value and ('=HYPERLINK(' in str(cell_value) or 'HYPERLINK(' in str(cell_value)) and worksheet_title in str(cell_value):
-                    hyperlink_exists = True
-                    break
-            
-            if not hyperlink_exists:
-                next_available_row_K = len(cell_list_K) + 1
-                # Use the new_worksheet object directly instead of looking it up again
-                worksheet_url = f"https://docs.google.com/spreadsheets/d/{sh.id}/edit#gid={new_worksheet.id}"
-                # Use proper HYPERLINK formula syntax with semicolon separator
-                hyperlink_formula = f'=HYPERLINK("{worksheet_url}";"{worksheet_title}")'
-                overview_updates.append((f"K{next_available_row_K}", hyperlink_formula))
-
-            # Update regular cells in batch
-            if overview_updates:
-                batch_data = [{'range': cell, 'values': [[value]]} for cell, value in overview_updates]
-                overview_ws.batch_update(batch_data)
-                print(f"Updated {len(overview_updates)} regular cells in batch")
-            
-            # Update hyperlink separately using update_acell to ensure it's treated as a formula
-            if not hyperlink_exists:
-                overview_ws.update_acell(f"K{next_available_row_K}", hyperlink_formula)
-                print(f"Updated hyperlink in K{next_available_row_K}")
-
-            # Set the header row in the new worksheet with Sunday-Saturday week range
-            week_start_sunday = week_start
-            week_end_saturday = week_start_sunday + timedelta(days=6)
-            new_worksheet.update_acell("B1:O1",
-                                       f"KW {week_number}{week_start_sunday.strftime('%y')} - {week_start_sunday:%d.%m.%Y} - {week_end_saturday:%d.%m.%Y}")
-        else:
+        existing_worksheet = self._get_worksheet(worksheet_title)
+        if existing_worksheet is not None:
             print("Using existing worksheet:", worksheet_title)
-            new_worksheet = existing_worksheet
+            return existing_worksheet
+
+        self.create_week_worksheets([(worksheet_title, week_number, week_start)])
+        return self._get_worksheet(worksheet_title)
+
+    def load_week_grids(self, worksheet_titles):
+        """
+        Load the B1:P8 block of every given week worksheet (and the template) that is not loaded yet
+        with a single values_batch_get. Titles of worksheets that don't exist yet are skipped.
+        """
+        titles_to_load = [title for title in dict.fromkeys(worksheet_titles) if title not in self._week_grids]
+        if titles_to_load:
+            worksheet_index = self._get_worksheet_index()
+            titles_to_load = [title for title in titles_to_load if title in worksheet_index]
+        # New week worksheets are copies of the template, so its grid is loaded along with the others
+        if TEMPLATE_WORKSHEET_TITLE not in self._week_grids and TEMPLATE_WORKSHEET_TITLE not in titles_to_load:
+            titles_to_load.insert(0, TEMPLATE_WORKSHEET_TITLE)
+        if not titles_to_load:
+            return
+
+        print(f"Loading {len(titles_to_load)} week grids in one request...")
+        try:
+            response = self._scheduler.call(get_spreadsheet().values_batch_get,
+                                            [f"'{title}'!{WeekGrid.RANGE}" for title in titles_to_load])
+        except APIError as e:
+            # A worksheet of the stored index was deleted, load again with the rebuilt one
+            if not self._rebuild_stale_worksheet_index(e):
+                raise
+            return self.load_week_grids(worksheet_titles)
+        for title, value_range in zip(titles_to_load, response.get('valueRanges', [])):
+            self._week_grids[title] = WeekGrid(value_range.get('values', []))
+
+    def prepare_week_worksheets_for_activities(self, activities):
+        """
+        Load the grids of all week worksheets the given activities fall into in one request,
+        and create the missing ones together in one batchUpdate
+        """
+        weeks = []
+        for activity in activities:
+            date = datetime.fromisoformat(activity['start_date_local'].replace('Z', '+00:00'))
+            weeks.append(self._get_week_info(date))
+        self.load_week_grids([week[0] for week in weeks])
+        self.create_week_worksheets(weeks)
+
+    def _get_week_grid(self, worksheet_title):
+        """
+        Get the in-memory grid of a week worksheet, loading it if it was not preloaded
+        """
+        if worksheet_title not in self._week_grids:
+            self.load_week_grids([worksheet_title])
+        return self._week_grids[worksheet_title]
+
+    def _set_cell(self, worksheet_title, cell, value):
+        """
+        Change a cell in the in-memory grid and queue the change in the write buffer
+        """
+        if worksheet_title in self._week_grids:
+            self._week_grids[worksheet_title].set(cell, value)
+        self._write_buffer.set(worksheet_title, cell, value)
+
+    def get_week_header(self, worksheet_title):
+        """
+        Get the B1 header of a week worksheet from its in-memory grid
+        """
+        return self._get_week_grid(worksheet_title).get("B1")
+
+    def write_cells(self, updates):
+        """
+        Write (worksheet title, cell, value) updates through the write buffer,
+        so they go out with a single values_batch_update
+        """
+        if self._write_buffer is None:
+            with self.buffered_writes():
+                return self.write_cells(updates)
+
+        for worksheet_title, cell, value in updates:
+            self._set_cell(worksheet_title, cell, value)
+
+    @contextmanager
+    def buffered_writes(self):
+        """
+        Collect the cell updates of every entry set inside the block and write them
+        in one request when the block ends
+        """
+        self._write_buffer = SheetWriteBuffer()
+        try:
+            yield self._write_buffer
+        except Exception:
+            # Still write the entries that were completed before the error
+            try:
+                self.flush_writes()
+            except Exception as flush_e:
+                print(f"Failed to write buffered updates: {flush_e}")
+            raise
+        else:
+            self.flush_writes()
+        finally:
+            self._write_buffer = None
+
+    def flush_writes(self):
+        """
+        Write all buffered cell updates in one spreadsheet-level values_batch_update
+        """
+        if self._write_buffer is None or not self._write_buffer.has_changes():
+            return
+
+        body = self._write_buffer.get_batch_update_body()
+        print(f"Executing {len(body['data'])} buffered updates in one batch...")
+        try:
+            self._scheduler.call(get_spreadsheet().values_batch_update, body)
+        except APIError as e:
+            # The updates can't go to a deleted worksheet, but later lookups should no longer find it
+            self._rebuild_stale_worksheet_index(e)
+            raise
+        # Only activities whose updates were written are recorded, so a failed run can simply be repeated
+        self.get_ledger().record_activities(self._write_buffer.get_ledger_entries())
+        self._write_buffer.clear()
+        print("Batch update completed successfully!")
+
+    def set_new_entry_from_json(self, activityDetails):
+        """
+        Set a new entry in the Google Sheets from a JSON object.
+        Inside buffered_writes() the cell updates are only collected; otherwise they are written right away.
+        """
+        if self._write_buffer is None:
+            with self.buffered_writes():
+                return self.set_new_entry_from_json(activityDetails)
+
+        # Entries are additive, so an activity that is already in the diary must not be written again
+        activity_id = activityDetails.get('id')
+        if activity_id is not None and (activity_id in self.get_ledger() or self._write_buffer.has_activity(activity_id)):
+            print(f"Activity {activity_id} is already in the diary, skipping it")
+            return
+
+        print("Setting new entry from JSON...")
+
+        # Extract the date from the activity details
+        date_str = activityDetails['start_date_local']
+        date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+
+        # Get the week worksheet the activity belongs to, creating it if needed
+        worksheet_title, week_number, week_start = self._get_week_info(date)
+        self._get_or_create_week_worksheet(worksheet_title, week_number, week_start)
+        grid = self._get_week_grid(worksheet_title)
 
         # Calculate the day of the week and column offset for Sunday-Saturday format
         # Convert to Sunday=0, Monday=1, ..., Saturday=6
@@ -254,13 +737,13 @@ class SheetsClient:
         # Calculate the row range based on the time of day
         row_range = "3:5" if date.hour < 13 else "6:8"
 
-        # Collect all updates to do them in batches
-        updates = []
-        
+        # What this activity adds to each cell, for the ledger
+        contributed_values = {}
+
         # Define a helper function to collect cell updates
         def collect_update(cell, text, is_additive=False, existing_value=None):
             """
-            Collect a cell update for batch processing
+            Collect a cell update in the grid and the write buffer, merged with the existing value
             """
             if is_additive:
                 try:
@@ -275,43 +758,16 @@ class SheetsClient:
                 
                 new_val = existing_val + text
                 formatted_val = locale.format_string("%.2f", new_val)
-                updates.append((cell, formatted_val))
+                self._set_cell(worksheet_title, cell, formatted_val)
+                contributed_values[cell] = locale.format_string("%.2f", text)
             else:
+                contributed_values[cell] = text
                 if existing_value:
-                    updates.append((cell, f"{existing_value}\n{text}"))
+                    self._set_cell(worksheet_title, cell, f"{existing_value}\n{text}")
                 else:
-                    updates.append((cell, text))
+                    self._set_cell(worksheet_title, cell, text)
         
-        # Define a helper function to get existing values in batch
-        def get_existing_values_batch(cells):
-            """
-            Get multiple cell values in one API call
-            """
-            try:
-                # Use batch_get to get multiple cells at once
-                cell_list = [f"{cell}" for cell in cells]
-                result = new_worksheet.batch_get(cell_list)
-                
-                # batch_get returns a list of lists, where each inner list contains values for one range
-                # For individual cells, each cell gets its own list in the result
-                result_dict = {}
-                for i, cell in enumerate(cells):
-                    if i < len(result) and result[i] and len(result[i]) > 0:
-                        # Get the first (and only) value from the cell's result list
-                        cell_value = result[i][0] if result[i][0] else None
-                        # If the cell_value is still a list (shouldn't happen but just in case), get the first element
-                        if isinstance(cell_value, list) and len(cell_value) > 0:
-                            cell_value = cell_value[0]
-                        result_dict[cell] = cell_value
-                    else:
-                        result_dict[cell] = None
-                
-                return result_dict
-            except Exception as e:
-                print(f"Error getting batch values: {e}")
-                return {cell: None for cell in cells}
-
-        # Get all existing values we need in one batch call
+        # Get all existing values we need
         cells_to_check = []
         if activityDetails['sport_type'] == 'Run':
             cells_to_check.extend([
@@ -325,12 +781,10 @@ class SheetsClient:
                 column_range[0] + row_range.split(":")[1],                # Private note cell
                 column_range[2] + row_range.split(":")[0]                 # Moving time cell
             ])
-        
-        # Add a small delay to ensure any previous updates are processed
-        time.sleep(0.2)
-        
-        existing_values = get_existing_values_batch(cells_to_check)
-        
+
+        # Read the existing values from the in-memory grid, which already holds this run's earlier changes
+        existing_values = {cell: grid.get(cell) for cell in cells_to_check}
+
         # Process the activity details based on the sport type
         if activityDetails['sport_type'] == 'Run':
             print("Processing Run activity...")
@@ -384,46 +838,14 @@ class SheetsClient:
                     is_additive=True,
                     existing_value=existing_values[column_range[2] + row_range.split(":")[0]]
                 )
-        
-        # Execute all updates in one batch call
-        if updates:
-            print(f"Executing {len(updates)} updates in batch...")
-            try:
-                # Use batch_update with proper format: list of dicts with 'range' and 'values'
-                batch_data = [{'range': cell, 'values': [[value]]} for cell, value in updates]
-                new_worksheet.batch_update(batch_data)
-                print("Batch update completed successfully!")
-                
-                # Add small delay after successful batch update to respect rate limits
-                time.sleep(0.2)
-                
-            except APIError as e:
-                if e.code == 429:
-                    print("Rate limit exceeded during batch update. Waiting 60 seconds...")
-                    time.sleep(60)
-                    # Retry the batch update
-                    try:
-                        new_worksheet.batch_update(batch_data)
-                        print("Batch update retry completed successfully!")
-                        time.sleep(0.2)  # Small delay after retry
-                    except Exception as retry_e:
-                        print(f"Batch update retry failed: {retry_e}")
-                        # Fallback to individual updates if batch fails
-                        for cell, value in updates:
-                            try:
-                                new_worksheet.update_acell(cell, value)
-                                time.sleep(0.5)  # Longer delay for individual updates
-                            except Exception as fallback_e:
-                                print(f"Failed to update {cell}: {fallback_e}")
-                else:
-                    print(f"Batch update failed: {e}")
-                    # Fallback to individual updates
-                    for cell, value in updates:
-                        try:
-                            new_worksheet.update_acell(cell, value)
-                            time.sleep(0.5)  # Longer delay for individual updates
-                        except Exception as fallback_e:
-                            print(f"Failed to update {cell}: {fallback_e}")
+
+        if activity_id is not None:
+            self._write_buffer.add_ledger_entry({
+                'activity_id': activity_id,
+                'worksheet_title': worksheet_title,
+                'start_date_local': date_str,
+                'cells': contributed_values,
+            })
 
     def get_empty_p4_p7_worksheets(self):
         print("Getting empty P4/P7 worksheets...")
@@ -434,63 +856,38 @@ class SheetsClient:
             print("No worksheets found.")
             return None
         
-        print(f"Checking {len(worksheets)} worksheets with rate limiting...")
+        print(f"Checking {len(worksheets)} worksheets...")
         
-        # Get all P4 and P7 values in one batch call per worksheet
+        # Read P4:P7 of many worksheets per spreadsheet-level request; the chunks only keep the request URL short
         empty_worksheets = []
-        for i, ws in enumerate(worksheets):
+        for chunk_start in range(0, len(worksheets), P4_P7_BATCH_SIZE):
+            chunk = worksheets[chunk_start:chunk_start + P4_P7_BATCH_SIZE]
+            ranges = [f"'{ws.title}'!P4:P7" for ws in chunk]
             try:
-                # Add rate limiting - wait 0.3 seconds between API calls to avoid 429 errors
-                if i > 0:  # Don't wait before the first call
-                    time.sleep(0.3)
-                
-                # Progress indicator every 10 worksheets
-                if i % 10 == 0:
-                    print(f"Progress: {i}/{len(worksheets)} worksheets checked...")
-                
-                # Get both P4 and P7 values in one API call
-                p4_p7_values = ws.batch_get(["P4", "P7"])
-                p4_value = p4_p7_values[0][0] if p4_p7_values[0] else None
-                p7_value = p4_p7_values[0][1] if len(p4_p7_values[0]) > 1 else None
-                
+                response = self._scheduler.call(get_spreadsheet().values_batch_get, ranges)
+            except APIError as e:
+                # A worksheet of the stored index was deleted, check again with the rebuilt one
+                if not self._rebuild_stale_worksheet_index(e):
+                    raise
+                return self.get_empty_p4_p7_worksheets()
+
+            for ws, value_range in zip(chunk, response.get('valueRanges', [])):
+                # Rows of P4:P7, trailing empty rows are left out by the API
+                values = value_range.get('values', [])
+                p4_value = values[0][0] if len(values) > 0 and values[0] else None
+                p7_value = values[3][0] if len(values) > 3 and values[3] else None
+
                 # Check if both P4 and P7 are empty (None, empty string, or "0")
-                p4_empty = not p4_value or p4_value == "" or p4_value == "0"
-                p7_empty = not p7_value or p7_value == "" or p7_value == "0"
-                
+                p4_empty = not p4_value or p4_value == "0"
+                p7_empty = not p7_value or p7_value == "0"
+
                 if p4_empty and p7_empty:
                     empty_worksheets.append(ws)
                 else:
                     print(f"Found non-empty P4/P7 in worksheet {ws.title} (P4: {p4_value}, P7: {p7_value})")
                     # Stop when we find the first non-empty worksheet
-                    break
-                    
-            except APIError as e:
-                if e.code == 429:  # Rate limit exceeded
-                    print(f"Rate limit exceeded while checking worksheet {ws.title}. Waiting 60 seconds...")
-                    time.sleep(60)  # Wait 60 seconds for rate limit to reset
-                    # Retry the same worksheet
-                    try:
-                        p4_p7_values = ws.batch_get(["P4", "P7"])
-                        p4_value = p4_p7_values[0][0] if p4_p7_values[0] else None
-                        p7_value = p4_p7_values[0][1] if len(p4_p7_values[0]) > 1 else None
-                        
-                        p4_empty = not p4_value or p4_value == "" or p4_value == "0"
-                        p7_empty = not p7_value or p7_value == "" or p7_value == "0"
-                        
-                        if p4_empty and p7_empty:
-                            empty_worksheets.append(ws)
-                        else:
-                            print(f"Found non-empty P4/P7 in worksheet {ws.title} after retry (P4: {p4_value}, P7: {p7_value})")
-                            break
-                    except Exception as retry_e:
-                        print(f"Error retrying worksheet {ws.title}: {retry_e}")
-                        continue
-                else:
-                    print(f"Error checking worksheet {ws.title}: {e}")
-                    continue
-            except Exception as e:
-                print(f"Error checking worksheet {ws.title}: {e}")
-                continue
-        
+                    print(f"Found {len(empty_worksheets)} empty P4/P7 worksheets.")
+                    return empty_worksheets
+
         print(f"Found {len(empty_worksheets)} empty P4/P7 worksheets.")
-        return empty_worksheets
\ No newline at end of file
+        return empty_worksheets
@@ -1,14 +1,93 @@
 import os
 import json
-from datetime import datetime
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
 
 # Import necessary libraries for OAuth2 and environment variables
+from requests.adapters import HTTPAdapter
 from requests_oauthlib import OAuth2Session
 from dotenv import load_dotenv
 
+from activity_store import ActivityStore
+from detail_cache import ActivityDetailCache
+
 # Load environment variables from .env file
 load_dotenv()
 
+# Strava summaries don't include the description, so a cached detail can't tell that only the description
+# was edited. Descriptions are mostly edited in the days after an activity, so recent activities are always
+# fetched fresh.
+DETAIL_CACHE_MIN_AGE_DAYS = 14
+
+class StravaRateLimiter:
+    """
+    Keeps track of Strava's 15-minute and daily request limits and blocks before they would be exceeded.
+    Strava's 15-minute windows start at 0, 15, 30 and 45 minutes past the hour, the daily one at midnight UTC.
+    """
+    def __init__(self, short_term_limit=100, daily_limit=1000):
+        self.short_term_limit = short_term_limit
+        self.daily_limit = daily_limit
+        self._lock = threading.Lock()
+        self._window_start = None
+        self._day = None
+        self._short_term_usage = 0
+        self._daily_usage = 0
+
+    def _reset_expired_windows(self, now):
+        # Start counting from zero once a new 15-minute window or a new day has begun
+        window_start = int(now // 900) * 900
+        if window_start != self._window_start:
+            self._window_start = window_start
+            self._short_term_usage = 0
+        day = int(now // 86400)
+        if day != self._day:
+            self._day = day
+            self._daily_usage = 0
+
+    def acquire(self):
+        # Reserve one request, waiting for the next 15-minute window if the current one is used up
+        while True:
+            with self._lock:
+                now = time.time()
+                self._reset_expired_windows(now)
+                if self._daily_usage >= self.daily_limit:
+                    raise Exception("Strava daily request limit reached, try again tomorrow")
+                if self._short_term_usage < self.short_term_limit:
+                    self._short_term_usage += 1
+                    self._daily_usage += 1
+                    return
+                wait_seconds = self._window_start + 900 - now
+            print(f"Strava 15-minute request limit reached. Waiting {wait_seconds:.0f} seconds...")
+            time.sleep(wait_seconds)
+
+    def update_from_headers(self, headers):
+        # Take over the limits and usage reported by Strava, preferring the stricter read limits
+        limit = headers.get('X-ReadRateLimit-Limit') or headers.get('X-RateLimit-Limit')
+        usage = headers.get('X-ReadRateLimit-Usage') or headers.get('X-RateLimit-Usage')
+        if not limit or not usage:
+            return
+        try:
+            short_term_limit, daily_limit = (int(value) for value in limit.split(','))
+            short_term_usage, daily_usage = (int(value) for value in usage.split(','))
+        except ValueError:
+            return
+        with self._lock:
+            self._reset_expired_windows(time.time())
+            self.short_term_limit = short_term_limit
+            self.daily_limit = daily_limit
+            self._short_term_usage = max(self._short_term_usage, short_term_usage)
+            self._daily_usage = max(self._daily_usage, daily_usage)
+
+
 class StravaClient:
     def __init__(self):
         # Initialize Strava client with necessary variables
@@ -20,6 +99,30 @@ class StravaClient:
         self.athlete_activities_url = "https://www.strava.com/api/v3/athlete/activities/"
         self.token_url = "https://www.strava.com/api/v3/oauth/token"
         self.auth_base_url = "https://www.strava.com/oauth/authorize"
+        # Local activity store that is kept up to date with delta fetches
+        self.store_file = "strava_activities.db"
+        self.history_start_date = "2020-01-01 00:00:00"
+        # Days before the newest stored activity that are re-fetched on every sync to pick up edits
+        self.sync_lookback_days = 14
+        # Long ranges are split into windows of this many days that are fetched concurrently
+        self.partition_window_days = 91
+        self.partition_max_workers = 4
+        self._store = None
+        self._store_synced = False
+        # On-disk cache of activity details, keyed by ID and the edit-relevant summary fields
+        self.detail_cache_file = "strava_detail_cache.db"
+        self._detail_cache = None
+        # Columnar store of activity streams for the weekly aggregates
+        self.stream_store_directory = "activity_streams"
+        self._stream_store = None
+        # Shared by all threads so concurrent requests stay within Strava's rate limits
+        self.rate_limiter = StravaRateLimiter()
+        # One keep-alive session per client and the token cached in memory with its expiry
+        self.request_timeout_seconds = 30
+        self.token_refresh_margin_seconds = 300
+        self._session = None
+        self._tokens = None
+        self._token_lock = threading.RLock()
 
     def load_tokens(self):
         # Load tokens from file if it exists, otherwise return empty dictionary
@@ -30,31 +133,82 @@ class StravaClient:
             return {}
 
     def save_tokens(self, tokens):
-        # Save tokens to file
-        with open(self.token_file, "w") as f:
+        # Save tokens to file. Callers hold _token_file_lock; the temporary file is moved into place
+        # so a reader or a crash never sees a truncated token file
+        directory = os.path.dirname(os.path.abspath(self.token_file))
+        with tempfile.NamedTemporaryFile("w", dir=directory, prefix=".strava_tokens.", suffix=".tmp",
+                                         delete=False) as f:
             json.dump(tokens, f)
+            temporary_file = f.name
+        try:
+            os.replace(temporary_file, self.token_file)
+        except OSError:
+            os.remove(temporary_file)
+            raise
+
+    @contextmanager
+    def _token_file_lock(self):
+        # Hold an exclusive lock on a sidecar lock file so concurrent runs don't refresh the token at the same time
+        with open(f"{self.token_file}.lock", "a+") as lock_file:
+            if os.name == "nt":
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if os.name == "nt":
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _token_is_fresh(self, tokens):
+        # Tokens without a known expiry are treated as expired so they get refreshed once
+        return bool(tokens.get("access_token")) and \
+            tokens.get("expires_at", 0) - self.token_refresh_margin_seconds > time.time()
 
     def get_token(self):
-        # Get access token from loaded tokens
-        tokens = self.load_tokens()
-        return tokens.get("access_token")
+        # Get a valid access token from memory, refreshing it shortly before it expires
+        with self._token_lock:
+            if self._tokens is None:
+                self._tokens = self.load_tokens()
+            if not self._tokens.get("access_token"):
+                self._tokens = {}
+                self.authenticate()
+            elif not self._token_is_fresh(self._tokens):
+                self.refresh_token()
+            return self._tokens["access_token"]
 
     def save_token(self, token):
-        # Save new token to file
+        # Save new token to file and keep it in memory
         tokens = self.load_tokens()
         tokens["access_token"] = token["access_token"]
         tokens["refresh_token"] = token["refresh_token"]
+        tokens["expires_at"] = int(token.get("expires_at", time.time() + token.get("expires_in", 0)))
         self.save_tokens(tokens)
+        self._tokens = tokens
+        if self._session is not None:
+            self._session.token = {"access_token": tokens["access_token"], "token_type": "Bearer"}
 
-    def refresh_token(self):
+    def refresh_token(self, stale_access_token=None):
         # Refresh access token using refresh token
-        tokens = self.load_tokens()
-        refresh_token = tokens["refresh_token"]
-        session = OAuth2Session(client_id=self.client_id, redirect_uri=self.redirect_url)
-        token = session.refresh_token(self.token_url, refresh_token=refresh_token, client_id=self.client_id,
-                                      client_secret=self.client_secret)
-        self.save_token(token)
-        return token["access_token"]
+        with self._token_lock, self._token_file_lock():
+            # Another thread or run may already have refreshed the token in the meantime
+            tokens = self.load_tokens()
+            if tokens.get("access_token") != stale_access_token and self._token_is_fresh(tokens):
+                self._tokens = tokens
+                if self._session is not None:
+                    self._session.token = {"access_token": tokens["access_token"], "token_type": "Bearer"}
+                return tokens["access_token"]
+
+            print("Refreshing Strava access token...")
+            session = OAuth2Session(client_id=self.client_id, redirect_uri=self.redirect_url)
+            token = session.refresh_token(self.token_url, refresh_token=tokens["refresh_token"],
+                                          client_id=self.client_id, client_secret=self.client_secret)
+            self.save_token(token)
+            return token["access_token"]
 
     def authenticate(self):
         # Authenticate user and get access token
@@ -65,80 +219,274 @@ class StravaClient:
         redirect_response = input(f"Paste redirect url here: ")
         token = session.fetch_token(self.token_url, client_id=self.client_id, client_secret=self.client_secret,
                                     authorization_response=redirect_response, include_client_id=True)
-        self.save_token(token)
+        with self._token_file_lock():
+            self.save_token(token)
         return token["access_token"]
 
-    def get_strava_data_for_activity_with_specific_ID(self, activity_id, include_efforts):
-        # Get Strava data for specific activity ID
+    def _get_session(self):
+        # Create the long-lived keep-alive session on first use
         access_token = self.get_token()
-        if access_token is None:
-            access_token = self.authenticate()
-        else:
+        with self._token_lock:
+            if self._session is None:
+                self._session = OAuth2Session(client_id=self.client_id,
+                                              token={"access_token": access_token, "token_type": "Bearer"})
+                # Keep enough pooled connections for the concurrent detail fetches
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=16)
+                self._session.mount("https://", adapter)
+            return self._session
+
+    def _get(self, url):
+        """
+        Send a GET request over the shared session once the rate limiter allows it.
+        A 401 triggers one token refresh and a retry of this single request only.
+        """
+        session = self._get_session()
+        access_token = self.get_token()
+        self.rate_limiter.acquire()
+        response = session.get(url, timeout=self.request_timeout_seconds)
+        self.rate_limiter.update_from_headers(response.headers)
+
+        if response.status_code == 401:
+            print("Strava rejected the access token, refreshing it and retrying the request...")
+            self.refresh_token(stale_access_token=access_token)
+            self.rate_limiter.acquire()
+            response = session.get(url, timeout=self.request_timeout_seconds)
+            self.rate_limiter.update_from_headers(response.headers)
+
+        response.raise_for_status()
+        return response
+
+    def get_detail_cache(self):
+        # Open the activity detail cache on first use
+        if self._detail_cache is None:
+            self._detail_cache = ActivityDetailCache(self.detail_cache_file)
+        return self._detail_cache
+
+    def get_strava_data_for_activity_with_specific_ID(self, activity_id, include_efforts, summary=None):
+        """
+        Get Strava data for specific activity ID.
+        If the activity summary is given, the details of activities older than DETAIL_CACHE_MIN_AGE_DAYS
+        are served from the detail cache while the summary's edit-relevant fields are unchanged.
+        """
+        if summary is not None:
+            cached_details = self._get_cached_details(activity_id, include_efforts, summary)
+            if cached_details is not None:
+                return cached_details
+        return self._fetch_details(activity_id, include_efforts, summary)
+
+    def _get_cached_details(self, activity_id, include_efforts, summary):
+        start_date = datetime.strptime(summary['start_date'], "%Y-%m-%dT%H:%M:%SZ")
+        if start_date > datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=DETAIL_CACHE_MIN_AGE_DAYS):
+            return None
+        return self.get_detail_cache().get(ActivityDetailCache.make_key(activity_id, include_efforts, summary))
+
+    def _fetch_details(self, activity_id, include_efforts, summary=None):
+        response = self._get(f"{self.activities_url}{activity_id}?include_all_efforts={str(include_efforts).lower()}")
+        details = response.json()
+
+        if summary is not None:
+            cache_key = ActivityDetailCache.make_key(activity_id, include_efforts, summary)
+            self.get_detail_cache().put(cache_key, activity_id, include_efforts, details)
+        return details
+
+    def get_activities_details(self, activities, include_efforts=False, max_workers=4):
+        """
+        Get the Strava data for several activities concurrently.
+        Accepts activity IDs or activity summaries (which enables the detail cache) and
+        returns the results in the same order.
+        """
+        activities = list(activities)
+        if not activities:
+            return []
+
+        # Serve what the detail cache has first, so a fully cached batch needs no token
+        activities_details = [self._get_cached_details(activity['id'], include_efforts, activity)
+                              if isinstance(activity, dict) else None
+                              for activity in activities]
+        missing = [i for i, details in enumerate(activities_details) if details is None]
+        if missing:
+            # Make sure a valid token exists before the workers start, so it is refreshed only once
+            self._get_session()
+
+            def fetch_details(activity):
+                if isinstance(activity, dict):
+                    return self._fetch_details(activity['id'], include_efforts, summary=activity)
+                return self._fetch_details(activity, include_efforts)
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for i, details in zip(missing, executor.map(fetch_details, [activities[i] for i in missing])):
+                    activities_details[i] = details
+
+        if self._detail_cache is not None:
+            stats = self._detail_cache.stats()
+            print(f"Detail cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
+        return activities_details
+
+    def get_activity_streams(self, activity_id):
+        """
+        Get the time, distance, heart rate and velocity streams of an activity.
+        Returns a dict with the data per stream type; streams the activity lacks are left out.
+        """
+        # NumPy is only needed for streams, so it is imported on first use
+        from stream_store import STREAM_FIELDS
+
+        response = self._get(
+            f"{self.activities_url}{activity_id}/streams?keys={','.join(STREAM_FIELDS)}&key_by_type=true")
+        return {stream_type: stream['data'] for stream_type, stream in response.json().items()}
+
+    def get_stream_store(self):
+        # Open the activity stream store on first use
+        if self._stream_store is None:
+            from stream_store import ActivityStreamStore
+            self._stream_store = ActivityStreamStore(self.stream_store_directory)
+        return self._stream_store
+
+    def sync_activity_streams(self, activities, max_workers=4):
+        """
+        Fetch the streams of all given activities that are not in the stream store yet.
+        Streams are appended as they arrive, so progress survives hitting the daily rate limit: a rate limit
+        stops the sync early and leaves the rest for the next run, any other error is raised.
+        """
+        stream_store = self.get_stream_store()
+        missing_activities = [activity for activity in activities if activity['id'] not in stream_store]
+        if not missing_activities:
+            return 0
+
+        print(f"Fetching streams for {len(missing_activities)} activities...")
+        self._get_session()
+        stored_count = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.get_activity_streams, activity['id']): activity
+                       for activity in missing_activities}
             try:
-                # Try to make a request with the current access token
-                session = OAuth2Session(client_id=self.client_id, token={"access_token": access_token})
-                response = session.get(f"{self.activities_url}{activity_id}?include_all_efforts={str(include_efforts).lower()}")
-                response.raise_for_status()
+                for future in as_completed(futures):
+                    activity = futures[future]
+                    try:
+                        streams = future.result()
+                    except Exception as e:
+                        # Manual activities have no streams; they are stored empty so they are not fetched again
+                        if getattr(getattr(e, 'response', None), 'status_code', None) != 404:
+                            raise
+                        streams = {}
+                    stream_store.append_activity(activity['id'], activity['start_date_local'], streams)
+                    stored_count += 1
             except Exception as e:
-                # If the request fails, refresh the token and try again
-                print(f"Request failed with error: {e}")
-                access_token = self.refresh_token()
-                session = OAuth2Session(client_id=self.client_id, token={"access_token": access_token})
-                response = session.get(
-                    f"{self.activities_url}{activity_id}?include_all_efforts={str(include_efforts).lower()}")
-                response.raise_for_status()
-            return response.json()
+                for future in futures:
+                    future.cancel()
+                if not self._is_rate_limit_error(e):
+                    raise
+                print(f"❌ Stopped fetching streams after {stored_count} activities: {e}")
+        return stored_count
 
-    def get_all_activities_in_timeframe(self, start_date, end_date):
-        # Get all activities in a specific timeframe
-        start_timestamp = int(datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S").timestamp())
-        end_timestamp = int(datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S").timestamp())
-        access_token = self.get_token()
-        if access_token is None:
-            access_token = self.authenticate()
-        
-        # Initialize activities list outside the try/except blocks
-        activities = []
-        
+    @staticmethod
+    def _is_rate_limit_error(error):
+        # Either Strava answered 429 or the rate limiter refused a request beyond the daily limit
+        if getattr(getattr(error, 'response', None), 'status_code', None) == 429:
+            return True
+        return "daily request limit" in str(error)
+
+    def _iter_activities(self, after_timestamp, before_timestamp):
+        """
+        Yield all activities that started between the two Unix timestamps as each page arrives.
+        The next page is fetched in the background while the caller works through the current one.
+        """
+        def fetch_page(page):
+            return self._get(
+                f"{self.athlete_activities_url}?before={before_timestamp}&after={after_timestamp}&page={page}&per_page=200").json()
+
+        executor = ThreadPoolExecutor(max_workers=1)
         try:
-            # Try to make a request with the current access token
-            session = OAuth2Session(client_id=self.client_id, token={"access_token": access_token})
             page = 1
-            while True:
-                response = session.get(
-                    f"{self.athlete_activities_url}?before={end_timestamp}&after={start_timestamp}&page={page}&per_page=200")
-                response.raise_for_status()
-                activities.extend(response.json())
-                if len(response.json()) < 200:
-                    break
-                page += 1
-        except Exception as e:
-            # If the request fails, refresh the token and try again
-            print(f"Request failed with error: {e}")
-            print(f"Error type: {type(e).__name__}")
-            try:
-                access_token = self.refresh_token()
-                if access_token is None:
-                    print("❌ Failed to refresh token, attempting re-authentication...")
-                    access_token = self.authenticate()
-                
-                session = OAuth2Session(client_id=self.client_id, token={"access_token": access_token})
-                page = 1
-                while True:
-                    response = session.get(
-                        f"{self.athlete_activities_url}?before={end_timestamp}&after={start_timestamp}&page={page}&per_page=200")
-                    response.raise_for_status()
-                    activities.extend(response.json())
-                    if len(response.json()) < 200:
-                        break
+            next_page = executor.submit(fetch_page, page)
+            while next_page is not None:
+                page_activities = next_page.result()
+                # Only a full page can be followed by another one
+                if len(page_activities) == 200:
                     page += 1
-                print(f"✅ Successfully fetched activities after token refresh")
-            except Exception as e2:
-                print(f"❌ Failed to fetch activities even after token refresh: {e2}")
-                print(f"Second error type: {type(e2).__name__}")
-                raise
-        
-        return activities
+                    next_page = executor.submit(fetch_page, page)
+                else:
+                    next_page = None
+                yield from page_activities
+        finally:
+            # Don't wait for a prefetched page the caller no longer needs
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_activities(self, start_date, end_date):
+        # Stream all activities in a specific timeframe directly from the Strava API, oldest first
+        start_timestamp = int(datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S").timestamp())
+        end_timestamp = int(datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S").timestamp())
+        return self._iter_activities(start_timestamp, end_timestamp)
+
+    def _fetch_activities(self, after_timestamp, before_timestamp):
+        """
+        Get all activities that started between the two Unix timestamps, oldest first.
+        Ranges longer than one partition window are split into windows that are fetched concurrently.
+        """
+        window_seconds = self.partition_window_days * 24 * 60 * 60
+        if before_timestamp - after_timestamp <= window_seconds:
+            return list(self._iter_activities(after_timestamp, before_timestamp))
+
+        # Strava's after/before bounds are exclusive, so neighbouring windows overlap by one second
+        windows = []
+        window_start = after_timestamp
+        while window_start < before_timestamp:
+            window_end = min(window_start + window_seconds, before_timestamp)
+            windows.append((window_start, window_end))
+            window_start = window_end - 1 if window_end < before_timestamp else window_end
+        print(f"Fetching activities in {len(windows)} time windows with {self.partition_max_workers} workers...")
+
+        with ThreadPoolExecutor(max_workers=self.partition_max_workers) as executor:
+            window_activities = executor.map(lambda window: list(self._iter_activities(*window)), windows)
+            # Merge the windows, dropping activities that appear in two overlapping windows
+            activities_by_id = {}
+            for activities in window_activities:
+                for activity in activities:
+                    activities_by_id[activity['id']] = activity
+
+        return sorted(activities_by_id.values(), key=lambda activity: (activity['start_date'], activity['id']))
+
+    def get_all_activities_in_timeframe(self, start_date, end_date):
+        # Get all activities in a specific timeframe directly from the Strava API, long ranges in parallel windows
+        start_timestamp = int(datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S").timestamp())
+        end_timestamp = int(datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S").timestamp())
+        return self._fetch_activities(start_timestamp, end_timestamp)
+
+    def get_activity_store(self):
+        # Open the local activity store on first use
+        if self._store is None:
+            self._store = ActivityStore(self.store_file)
+        return self._store
+
+    def sync_activity_store(self, force=False, full=False):
+        """
+        Bring the local activity store up to date with a delta fetch after its high-water mark.
+        Only runs once per client unless force is set; full re-downloads the whole history.
+        """
+        if self._store_synced and not force:
+            return
+
+        store = self.get_activity_store()
+        high_water_mark = store.get_high_water_mark()
+        before_timestamp = int(datetime.now().timestamp())
+
+        if high_water_mark is None or full:
+            print("Fetching full Strava history into the local activity store...")
+            after_timestamp = int(datetime.strptime(self.history_start_date, "%Y-%m-%d %H:%M:%S").timestamp())
+        else:
+            # Re-fetch a short window before the newest stored activity so recent edits and deletions are picked up
+            after_timestamp = high_water_mark - self.sync_lookback_days * 24 * 60 * 60
+
+        activities = self._fetch_activities(after_timestamp, before_timestamp)
+        store.replace_window(after_timestamp, before_timestamp, activities)
+        self._store_synced = True
+        print(f"✅ Activity store synced: {len(activities)} activities fetched, {store.count()} stored")
+
+    def get_stored_activities_in_timeframe(self, start_date, end_date):
+        # Get all activities in a specific timeframe from the local store, syncing it first if needed
+        self.sync_activity_store()
+        start_timestamp = int(datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S").timestamp())
+        end_timestamp = int(datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S").timestamp())
+        return self.get_activity_store().get_activities(start_timestamp, end_timestamp)
 
 def main():
     client = StravaClient()
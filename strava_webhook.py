@@ -0,0 +1,153 @@
+import json
+import os
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from dotenv import load_dotenv
+
+from activity_store import ActivityStore
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Pipelines that consume queued activity IDs
+SHEETS_PIPELINE = "sheets"
+GARMIN_PIPELINE = "garmin"
+
+# Fields of Strava's update events and the activity fields they correspond to
+UPDATE_FIELDS = {
+    'title': ['name'],
+    'type': ['type', 'sport_type'],
+    'private': ['private'],
+}
+
+
+def handle_event(store, event):
+    """
+    Apply a Strava push event to the local activity store and queue the affected activity
+    for the pipelines that have to act on it.
+
+    Args:
+        store (ActivityStore): The local activity store.
+        event (dict): The event payload sent by Strava.
+
+    Returns:
+        bool: True if the event was queued or applied, False if it was ignored.
+    """
+    if event.get('object_type') != 'activity':
+        return False
+
+    activity_id = event['object_id']
+    aspect_type = event.get('aspect_type')
+    event_time = event.get('event_time', 0)
+
+    if aspect_type == 'create':
+        # New activities go into the diary and get their title/description transferred to Garmin
+        store.queue_activity(activity_id, [SHEETS_PIPELINE, GARMIN_PIPELINE], aspect_type, event_time)
+    elif aspect_type == 'update':
+        # Keep the stored summary in line with the edit, then only Garmin has to catch up
+        fields = {}
+        for update_field, value in event.get('updates', {}).items():
+            for activity_field in UPDATE_FIELDS.get(update_field, []):
+                fields[activity_field] = value
+        if fields:
+            store.update_activity_fields(activity_id, fields)
+        # Manual entries don't exist on Garmin, so there is nothing to catch up
+        activity = store.get_activity(activity_id)
+        if activity is None or not activity.get('manual'):
+            store.queue_activity(activity_id, [GARMIN_PIPELINE], aspect_type, event_time)
+    elif aspect_type == 'delete':
+        store.delete_activity(activity_id)
+    else:
+        return False
+
+    print(f"Webhook event: {aspect_type} activity {activity_id}")
+    return True
+
+
+class StravaWebhookHandler(BaseHTTPRequestHandler):
+    """
+    Handles Strava's push subscription validation (GET) and event delivery (POST)
+    """
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        mode = query.get('hub.mode', [None])[0]
+        verify_token = query.get('hub.verify_token', [None])[0]
+        challenge = query.get('hub.challenge', [None])[0]
+
+        if mode == 'subscribe' and challenge and verify_token == self.server.verify_token:
+            print("Strava webhook subscription validated")
+            self._send_json(200, {'hub.challenge': challenge})
+        else:
+            self._send_json(403, {'error': 'invalid verification request'})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            event = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': 'invalid JSON'})
+            return
+
+        # Strava expects an answer within two seconds, so only the local store is touched here
+        handle_event(self.server.store, event)
+        self._send_json(200, {'status': 'ok'})
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # Events are already logged by handle_event
+        pass
+
+
+class StravaWebhookServer(HTTPServer):
+    """
+    A small HTTP endpoint for Strava's push subscriptions that queues changed activity IDs
+    in the local activity store
+    """
+    def __init__(self, host="0.0.0.0", port=8000, verify_token=None, store_file="strava_activities.db"):
+        super().__init__((host, port), StravaWebhookHandler)
+        self.verify_token = verify_token or os.getenv('STRAVA_WEBHOOK_VERIFY_TOKEN')
+        if not self.verify_token:
+            raise ValueError("STRAVA_WEBHOOK_VERIFY_TOKEN must be provided to validate the subscription")
+        self.store = ActivityStore(store_file)
+
+
+def replay_events(url, events):
+    """
+    Post recorded Strava event payloads to a webhook endpoint, standing in for Strava when testing.
+
+    Args:
+        url (str): The webhook URL, e.g. http://localhost:8000/.
+        events (list): The event payloads to send in order.
+
+    Returns:
+        list: The HTTP status codes of the responses.
+    """
+    status_codes = []
+    for event in events:
+        response = requests.post(url, json=event, timeout=10)
+        status_codes.append(response.status_code)
+    return status_codes
+
+
+def main():
+    port = int(os.getenv('STRAVA_WEBHOOK_PORT', 8000))
+    server = StravaWebhookServer(port=port)
+    print(f"Listening for Strava webhook events on port {port}...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
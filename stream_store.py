@@ -0,0 +1,168 @@
+import os
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+# Stream fields kept per activity and their on-disk types (missing streams are stored as NaN)
+STREAM_FIELDS = {
+    'time': np.dtype('<f8'),
+    'distance': np.dtype('<f4'),
+    'heartrate': np.dtype('<f4'),
+    'velocity_smooth': np.dtype('<f4'),
+}
+
+# One index row per activity pointing at its slice of every field file
+INDEX_DTYPE = np.dtype([
+    ('activity_id', '<i8'),
+    ('start_local_timestamp', '<i8'),
+    ('offset', '<i8'),
+    ('length', '<i8'),
+])
+
+
+class ActivityStreamStore:
+    """
+    A columnar on-disk store for Strava activity streams.
+    Every field lives in its own flat binary file that is read through memory maps, and an
+    index file records the offset and length of each activity's samples.
+    """
+    def __init__(self, directory="activity_streams"):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.index_file = os.path.join(self.directory, "index.bin")
+        if os.path.exists(self.index_file):
+            self._index = np.fromfile(self.index_file, dtype=INDEX_DTYPE)
+        else:
+            self._index = np.empty(0, dtype=INDEX_DTYPE)
+        self._activity_ids = set(self._index['activity_id'].tolist())
+
+    def _field_file(self, field):
+        return os.path.join(self.directory, f"{field}.bin")
+
+    def __contains__(self, activity_id):
+        return activity_id in self._activity_ids
+
+    def __len__(self):
+        return len(self._index)
+
+    def append_activity(self, activity_id, start_date_local, streams):
+        """
+        Append the streams of one activity to the field files and record it in the index.
+
+        Args:
+            activity_id (int): The Strava activity ID.
+            start_date_local (str): The local start time as returned by Strava.
+            streams (dict): Stream data per field name, as returned by StravaClient.get_activity_streams.
+        """
+        length = len(streams.get('time', []))
+        offset = int(self._index['offset'][-1] + self._index['length'][-1]) if len(self._index) else 0
+
+        for field, dtype in STREAM_FIELDS.items():
+            path = self._field_file(field)
+            # Drop samples an interrupted earlier append left behind without an index row
+            with open(path, "ab") as f:
+                f.truncate(offset * dtype.itemsize)
+            values = streams.get(field)
+            if values is None or len(values) != length:
+                values = np.full(length, np.nan, dtype=dtype)
+            with open(path, "ab") as f:
+                np.asarray(values, dtype=dtype).tofile(f)
+
+        # The index row is written last, so an activity only counts as stored once all fields are complete
+        start = datetime.strptime(start_date_local, "%Y-%m-%dT%H:%M:%SZ")
+        row = np.array([(activity_id, int((start - datetime(1970, 1, 1)).total_seconds()), offset, length)],
+                       dtype=INDEX_DTYPE)
+        with open(self.index_file, "ab") as f:
+            row.tofile(f)
+        self._index = np.concatenate([self._index, row])
+        self._activity_ids.add(activity_id)
+
+    def _memmap(self, field):
+        dtype = STREAM_FIELDS[field]
+        path = self._field_file(field)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def get_streams(self, activity_id):
+        """
+        Get the streams of one activity as arrays backed by the memory-mapped field files
+        """
+        rows = self._index[self._index['activity_id'] == activity_id]
+        if not len(rows):
+            return None
+        offset, length = int(rows[0]['offset']), int(rows[0]['length'])
+        return {field: self._memmap(field)[offset:offset + length] for field in STREAM_FIELDS}
+
+    def weekly_aggregates(self, start_date=None, end_date=None):
+        """
+        Compute per-week totals over all stored activities in the timeframe, using the same
+        Sunday-Saturday weeks as the training diary.
+
+        Args:
+            start_date (datetime): Only include activities starting at or after this local time.
+            end_date (datetime): Only include activities starting before this local time.
+
+        Returns:
+            list: One dict per week with week_start, activities, distance_km, duration_minutes,
+            average_heartrate and average_pace_min_per_km, oldest week first.
+        """
+        index = self._index[self._index['length'] > 0]
+        if start_date is not None:
+            index = index[index['start_local_timestamp'] >= int((start_date - datetime(1970, 1, 1)).total_seconds())]
+        if end_date is not None:
+            index = index[index['start_local_timestamp'] < int((end_date - datetime(1970, 1, 1)).total_seconds())]
+        if not len(index):
+            return []
+        index = np.sort(index, order='offset')
+
+        # Only the part of the field files that covers the selected activities is paged in
+        first = int(index['offset'][0])
+        last = int(index['offset'][-1] + index['length'][-1])
+        time_values = self._memmap('time')[first:last]
+        distance = self._memmap('distance')[first:last]
+        heartrate = self._memmap('heartrate')[first:last]
+        starts = index['offset'] - first
+        ends = starts + index['length'] - 1
+
+        # Per-activity totals: cumulative streams only need their first and last sample
+        activity_distance = np.nan_to_num(distance[ends].astype('f8'))
+        activity_time = time_values[ends] - time_values[starts]
+
+        # Time-weighted heart rate sums per activity; reduceat adds up each activity's slice
+        time_step = np.diff(time_values, prepend=time_values[:1])
+        time_step[starts] = 0
+        has_heartrate = ~np.isnan(heartrate)
+        weighted_heartrate = np.where(has_heartrate, heartrate, 0) * time_step
+        heartrate_time = np.where(has_heartrate, time_step, 0)
+        boundaries = np.unique(np.concatenate([starts, ends + 1]))
+        boundaries = boundaries[boundaries < len(time_values)]
+        segment_of_activity = np.searchsorted(boundaries, starts)
+        activity_heartrate_sum = np.add.reduceat(weighted_heartrate, boundaries)[segment_of_activity]
+        activity_heartrate_time = np.add.reduceat(heartrate_time, boundaries)[segment_of_activity]
+
+        # Sunday-based week start as days since the epoch (1970-01-01 was a Thursday)
+        days = index['start_local_timestamp'] // 86400
+        week_start_days = days - (days + 4) % 7
+        weeks, week_of_activity = np.unique(week_start_days, return_inverse=True)
+
+        week_activities = np.bincount(week_of_activity, minlength=len(weeks))
+        week_distance = np.bincount(week_of_activity, weights=activity_distance, minlength=len(weeks))
+        week_time = np.bincount(week_of_activity, weights=activity_time, minlength=len(weeks))
+        week_heartrate_sum = np.bincount(week_of_activity, weights=activity_heartrate_sum, minlength=len(weeks))
+        week_heartrate_time = np.bincount(week_of_activity, weights=activity_heartrate_time, minlength=len(weeks))
+
+        aggregates = []
+        for i, week_start_day in enumerate(weeks):
+            distance_km = week_distance[i] / 1000
+            aggregates.append({
+                'week_start': date(1970, 1, 1) + timedelta(days=int(week_start_day)),
+                'activities': int(week_activities[i]),
+                'distance_km': round(float(distance_km), 2),
+                'duration_minutes': round(float(week_time[i]) / 60),
+                'average_heartrate': round(float(week_heartrate_sum[i] / week_heartrate_time[i]), 1)
+                if week_heartrate_time[i] > 0 else None,
+                'average_pace_min_per_km': round(float(week_time[i] / 60 / distance_km), 2)
+                if distance_km > 0 else None,
+            })
+        return aggregates
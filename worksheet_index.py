@@ -0,0 +1,64 @@
+import json
+import os
+
+
+class WorksheetIndex:
+    """
+    A title → worksheet properties map of the spreadsheet, persisted as JSON between runs.
+    The stored index is trusted as is; the client rebuilds it when a lookup misses or the API
+    rejects a range, so worksheets added or removed by others are picked up on demand.
+    """
+    def __init__(self, index_file="worksheet_index.json"):
+        self.index_file = index_file
+        self._properties_by_title = {}
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self._properties_by_title = {properties['title']: properties for properties in data['sheets']}
+            except (ValueError, KeyError, TypeError):
+                print(f"Ignoring unreadable worksheet index {self.index_file}")
+                self._properties_by_title = {}
+
+    def __contains__(self, title):
+        return title in self._properties_by_title
+
+    def __len__(self):
+        return len(self._properties_by_title)
+
+    def rebuild(self, sheet_metadata):
+        """
+        Replace the index with the sheets of a fetch_sheet_metadata response
+        """
+        self._properties_by_title = {
+            sheet['properties']['title']: sheet['properties'] for sheet in sheet_metadata['sheets']
+        }
+        self.save()
+
+    def get(self, title):
+        """
+        Get the stored properties (sheetId, index, ...) of the worksheet with the given title, or None
+        """
+        return self._properties_by_title.get(title)
+
+    def get_all(self):
+        """
+        Get the properties of all worksheets in spreadsheet order
+        """
+        return sorted(self._properties_by_title.values(), key=lambda properties: properties['index'])
+
+    def add(self, properties):
+        """
+        Record a newly created worksheet, shifting the worksheets at or after its position back by one
+        """
+        for existing in self._properties_by_title.values():
+            if existing['index'] >= properties['index']:
+                existing['index'] += 1
+        self._properties_by_title[properties['title']] = dict(properties)
+
+    def save(self):
+        # Write to a temporary file first so an interrupted run never leaves a truncated index behind
+        temporary_file = f"{self.index_file}.tmp"
+        with open(temporary_file, "w", encoding="utf-8") as f:
+            json.dump({'sheets': self.get_all()}, f, ensure_ascii=False)
+        os.replace(temporary_file, self.index_file)